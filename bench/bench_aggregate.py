@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+""" Derived stats over many players: per-dict Python loop against ea.aggregate.
+
+  python bench/bench_aggregate.py [players ...]
+"""
+
+import os, sys, random
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ea.rpc import WEAPONS, VEHICLES
+from ea.aggregate import Players, WEAPON_KEYS, VEHICLE_KEYS
+
+COUNTRIES = ('us', 'de', 'ru', 'gb', 'fr', 'se', 'pl', 'nl')
+
+def fake_players(count, seed=2142):
+    """ Formatted player_info results; wep/veh rows come from a shared pool to save memory. """
+    rnd = random.Random(seed)
+    weps = [[dict(('%s-%d' % (key, n), rnd.randint(0, 500)) for key in WEAPON_KEYS
+                  for n in range(WEAPONS))] for i in range(64)]
+    vehs = [[dict(('%s-%d' % (key, n), rnd.randint(0, 100)) for key in VEHICLE_KEYS
+                  for n in range(VEHICLES))] for i in range(64)]
+    for pid in xrange(count):
+        yield {
+            'ovr': [{'pid': pid, 'gsco': rnd.randint(0, 10**6), 'tt': rnd.randint(0, 10**6),
+                     'win': rnd.randint(0, 900), 'los': rnd.randint(0, 900)}],
+            'ply': [{'pid': pid, 'klls': rnd.randint(0, 50000), 'dths': rnd.randint(0, 50000)}],
+            'wep': rnd.choice(weps),
+            'veh': rnd.choice(vehs),
+            'board': {'countrycode': rnd.choice(COUNTRIES), 'rank': rnd.randint(0, 43)},
+        }
+
+def ratio(a, b):
+    return b and float(a) / b or 0.0
+
+def python_loop(players):
+    """ The same numbers, one dict at a time. """
+    kdr, accu, spm, winr, country = [], [], [], [], []
+    for p in players:
+        ovr, ply, wep = p['ovr'][0], p['ply'][0], p['wep']
+        kdr.append((ply['pid'], ratio(ply['klls'], ply['dths'])))
+        hits = shots = 0
+        for row in wep:
+            for n in range(WEAPONS):
+                hits += row.get('whts-%d' % n, 0)
+                shots += row.get('wshts-%d' % n, 0)
+        accu.append(ratio(hits, shots))
+        spm.append(ratio(ovr['gsco'] * 60, ovr['tt']))
+        winr.append(ratio(ovr['win'], ovr['win'] + ovr['los']))
+        country.append(p['board']['countrycode'])
+    by_country = {}
+    for cc, value in zip(country, spm):
+        total, n = by_country.get(cc, (0.0, 0))
+        by_country[cc] = (total + value, n + 1)
+    ordered = sorted(winr)
+    return {
+        'top': sorted(kdr, key=lambda item: -item[1])[:10],
+        'median': ordered[len(ordered) // 2],
+        'accuracy': sum(accu) / len(accu),
+        'by_country': dict((cc, total / n) for cc, (total, n) in by_country.items()),
+    }
+
+def vectorized(players):
+    players = Players.load(players)
+    return players, vectorized_metrics(players)
+
+def vectorized_metrics(players):
+    return {
+        'top': players.top('kdr', 10),
+        'median': players.percentiles('win_ratio', 50),
+        'accuracy': players['accuracy'].mean(),
+        'by_country': players.group_by('countrycode', 'spm'),
+    }
+
+def main(*counts):
+    for count in counts or (10000, 100000):
+        data = list(fake_players(count))
+        start = time()
+        expected = python_loop(data)
+        loop = time() - start
+
+        start = time()
+        players, result = vectorized(data)
+        total = time() - start
+        players._derived.clear()
+        start = time()
+        vectorized_metrics(players)
+        compute = time() - start
+
+        assert [v for p, v in result['top']] == [v for p, v in expected['top']]
+        assert abs(result['accuracy'] - expected['accuracy']) < 1e-9
+        for cc, value in expected['by_country'].items():
+            assert abs(result['by_country'][cc] - value) < 1e-6
+        print '%7d players: loop %.3fs  numpy load+compute %.3fs  compute only %.4fs' % (
+            count, loop, total, compute)
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+""" Bytes on the wire and time of large responses, plain and compressed.
+
+A leaderboard window, the wep and map rows and a progress series are
+fetched from stand-ins serving identity, gzip and deflate bodies, over an
+unlimited link and a throttled one; results must match the plain ones.
+
+  python bench/bench_compress.py [bandwidth KiB/s] [rounds]
+"""
+
+import os, sys
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ea.rpc import RPC, Query
+from standin import StandIn
+
+CALLS = [
+    ('getleaderboard', {'type': 'overallscore', 'pos': 1, 'after': 1000}),
+    ('getplayerinfo', {'pid': 81970228, 'mode': 'wep'}),
+    ('getplayerinfo', {'pid': 81970228, 'mode': 'map'}),
+    ('getplayerprogress', {'pid': 81970228, 'mode': 'spm'}),
+]
+
+def fetch(host, rounds):
+    """ Results, body bytes received and seconds for rounds of CALLS. """
+    rpc = RPC(81970228, host=host)
+    wire = 0
+    start = time()
+    for n in range(rounds):
+        results = []
+        for func, kwargs in CALLS:
+            results.append(rpc.make_query(func, **kwargs))
+            wire += rpc.query.wire
+    return results, wire / rounds, (time() - start) / rounds
+
+def main(bandwidth=1024, rounds=5):
+    rounds = int(rounds)
+    expected = None
+    for limit in (0, int(bandwidth) * 1024):
+        print limit and 'link %d KiB/s' % (limit // 1024) or 'unlimited link'
+        for encodings in ((), ('gzip',), ('deflate',)):
+            server = StandIn(encodings=encodings, bandwidth=limit).start()
+            try:
+                results, wire, seconds = fetch(server.host, limit and 1 or rounds)
+            finally:
+                server.stop()
+            if expected is None:
+                expected = results
+            assert results == expected, 'results differ with %s' % (encodings,)
+            print '  %-9s %9d bytes %9.1f ms' % (encodings and encodings[0] or 'identity',
+                                                 wire, seconds * 1000)
+
+    Query.keep_response = True
+    server = StandIn(encodings=('gzip',)).start()
+    try:
+        assert fetch(server.host, 1)[0] == expected
+    finally:
+        server.stop()
+        Query.keep_response = False
+    print 'gzip keeping bodies: same results'
+
+if __name__ == '__main__':
+    main(*sys.argv[1:3])
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+""" Award and rank progress of many players: eval per player against ea.criteria.
+
+  python bench/bench_criteria.py [players ...]
+
+Uses the stand-in's sample config, fetched through the stand-in server.
+"""
+
+from __future__ import division
+import os, sys, ast
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ea.rpc import StatsWrapper, WEAPONS, VEHICLES
+from ea.aggregate import Players, WEAPON_KEYS, VEHICLE_KEYS
+from ea.criteria import Criteria
+from standin import StandIn, SAMPLE_CONFIG
+from bench_aggregate import fake_players
+
+def namespace(player):
+    """ A player's stats as names for eval. """
+    names = {}
+    for mode in ('ovr', 'ply'):
+        names.update(player[mode][0])
+    names['kdr'] = names['dths'] and float(names['klls']) / names['dths'] or 0.0
+    for rows, keys, width in ((player['wep'], WEAPON_KEYS, WEAPONS),
+                              (player['veh'], VEHICLE_KEYS, VEHICLES)):
+        for key in keys:
+            names[key] = [sum(row.get('%s-%d' % (key, n), 0) for row in rows) for n in range(width)]
+    return names
+
+def python_loop(players, config):
+    """ Levels and ranks, eval'ing every criterion for every player. """
+    tree = ast.parse(config)
+    awards, ranks = {}, []
+    for statement in tree.body:
+        entries = zip(statement.value.keys, statement.value.values)
+        for key, value in entries:
+            key = ast.literal_eval(key)
+            levels = isinstance(value, ast.List) and value.elts or [value]
+            code = [compile(ast.Expression(level), '<criteria>', 'eval', division.compiler_flag)
+                    for level in levels]
+            if statement.targets[0].id == 'awards':
+                awards[key] = code
+            else:
+                ranks.append((key, code[0]))
+    ranks.sort()
+    levels, reached = {}, []
+    for player in players:
+        names = namespace(player)
+        names['__builtins__'] = {'sum': sum, 'max': max, 'min': min}
+        for award, code in awards.items():
+            level = 0
+            for criterion in code:
+                if not eval(criterion, names):
+                    break
+                level += 1
+            levels.setdefault(award, []).append(level)
+        rank = 0
+        for number, criterion in ranks:
+            if not eval(criterion, names):
+                break
+            rank = number
+        reached.append(rank)
+    return levels, reached
+
+def main(*counts):
+    server = StandIn().start()
+    try:
+        start = time()
+        criteria = Criteria.fetch(StatsWrapper(host=server.host))
+        fetch = time() - start
+        start = time()
+        assert Criteria.fetch(StatsWrapper(host=server.host)) is criteria
+        cached = time() - start
+        start = time()
+        assert Criteria.fetch(StatsWrapper(host=server.host), ttl=0) is criteria
+        refetched = time() - start
+    finally:
+        server.stop()
+    print 'fetch+compile %.4fs, cached config %.4fs, refetched unchanged config %.4fs' % (
+        fetch, cached, refetched)
+
+    for count in counts or (10000, 100000):
+        data = list(fake_players(count))
+        for player in data:
+            # the stand-in config reads these too
+            player['ovr'][0].setdefault('tt', 0)
+            player['ply'][0].update(player['ovr'][0])
+        start = time()
+        levels, ranks = python_loop(data, SAMPLE_CONFIG)
+        loop = time() - start
+
+        players = Players.load(data)
+        start = time()
+        awards = criteria.awards(players)
+        rank, following, progress = criteria.ranks(players)
+        batch = time() - start
+
+        for award, result in awards.items():
+            assert list(result['level']) == levels[award], award
+        assert list(rank) == ranks
+        print '%7d players: eval loop %.3fs  compiled batch %.4fs' % (count, loop, batch)
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+""" Host selection on two stand-in servers with injected latency.
+
+Checks and times: routing to the faster host, hedging away tail latency,
+failover with the breaker ejecting a dead host, and its return once it
+answers probes again.
+
+  python bench/bench_hosts.py [requests]
+"""
+
+import os, sys
+from time import time, sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ea.rpc import RPC
+from ea.hosts import HostPool
+from standin import StandIn
+
+def timed(rpc, count):
+    times = []
+    for n in xrange(count):
+        start = time()
+        assert rpc.playersearch(nick='Butcher%d' % n)
+        times.append(time() - start)
+    times.sort()
+    return times
+
+def report(name, times):
+    print '%-28s mean %6.1f ms  p50 %6.1f ms  p99 %6.1f ms' % (
+        name, sum(times) / len(times) * 1000,
+        times[len(times) // 2] * 1000, times[int(len(times) * 0.99)] * 1000)
+
+def served(*servers):
+    return [server.requests.get('playersearch', 0) for server in servers]
+
+def main(count=200):
+    # routing: one slow, one fast host
+    slow, fast = StandIn(latency=0.06).start(), StandIn(latency=0.01).start()
+    report('bound to slow host', timed(RPC(host=slow.host), count // 4))
+    slow.requests.clear()
+    report('pool', timed(RPC(host=HostPool([slow.host, fast.host])), count))
+    print '  requests slow/fast: %d/%d' % tuple(served(slow, fast))
+    assert served(fast)[0] > served(slow)[0] * 5
+    slow.stop(), fast.stop()
+
+    # hedging: the fast host sometimes stalls
+    flaky = StandIn(latency=0.01, slow_rate=0.05, slow=0.3).start()
+    steady = StandIn(latency=0.03).start()
+    hosts = [flaky.host, steady.host]
+    report('bound to stalling host', timed(RPC(host=flaky.host), count))
+    report('pool, no hedging', timed(RPC(host=HostPool(hosts, hedge=None)), count))
+    report('pool, hedging', timed(RPC(host=HostPool(hosts)), count))
+    flaky.stop(), steady.stop()
+
+    # failover and breaker
+    first, second = StandIn(latency=0.01).start(), StandIn(latency=0.03).start()
+    # a dead host is avoided by its error rate alone; failures=1 ejects it at once
+    pool = HostPool([first.host, second.host], failures=1, cooldown=1.0)
+    rpc = RPC(host=pool)
+    timed(rpc, 20)
+    port = first.server_address[1]
+    first.stop()
+    report('first host down', timed(rpc, count // 4))
+    assert pool[first.host].open_until, 'dead host was not ejected'
+    print '  ejected:', pool[first.host]
+    first = StandIn(port=port, latency=0.01).start()
+    sleep(1.0)
+    timed(rpc, 20)
+    first.requests.clear(), second.requests.clear()
+    report('first host back', timed(rpc, count // 4))
+    print '  requests first/second: %d/%d' % tuple(served(first, second))
+    assert served(first)[0] > served(second)[0]
+    first.stop(), second.stop()
+
+    # batches are accounted and fail over like single queries
+    broken, good = StandIn(fail=('getplayerinfo',)).start(), StandIn().start()
+    pool = HostPool([broken.host, good.host], failures=1, explore=0)
+    calls = [('getplayerinfo', {'mode': mode}) for mode in ('ovr', 'ply', 'wep')]
+    results = RPC(host=pool).make_batch(calls)
+    on_good = good.requests.get('getplayerinfo', 0)
+    assert None not in results and on_good == len(calls), 'batch did not fail over'
+    assert pool[broken.host].open_until and pool[good.host].latency is not None
+    print 'batch on a failing host: failed over, %d requests on the good one' % on_good
+    broken.stop(), good.stop()
+
+    # a hedge that lost and answers late must not replace the query that won
+    stalling, steady = StandIn(latency=0.01).start(), StandIn(latency=0.03).start()
+    rpc = RPC(host=HostPool([stalling.host, steady.host], explore=0))
+    timed(rpc, 10)
+    stalling.slow_rate, stalling.slow = 1.0, 0.3
+    rpc.playersearch(nick='first')
+    stalling.slow_rate = 0 # its stalled playersearch still answers in the meantime
+    rpc.getplayerinfo(pid=81970228, mode='ovr')
+    sleep(0.5)
+    assert rpc.query.request.startswith('/getplayerinfo'), 'late hedge replaced rpc.query'
+    print 'late hedge: rpc.query kept the last query'
+    stalling.stop(), steady.stop()
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:2]))
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+""" One player's eight player_info modes, awards and unlocks: sequential
+queries against one pipelined batch, on a stand-in server with latency.
+
+Also checks that a batch survives the server closing or dropping the
+connection in the middle of it and that an HTTP error fails only its own
+query.
+
+  python bench/bench_pipeline.py [latency ms] [players]
+"""
+
+import os, sys
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ea.rpc import StatsWrapper
+from standin import StandIn
+
+def sequential(stats, pid):
+    player = dict((mode, stats._format_player_info(
+                      mode, stats._rpc.getplayerinfo(pid=pid, mode=mode)))
+                  for mode in sorted(stats.player_info_modes))
+    player['awards'] = stats.get_awards(pid)
+    player['unlocks'] = stats.get_unlocks_info(pid)
+    return player
+
+def main(latency=20, players=5):
+    server = StandIn(latency=latency / 1000.0).start()
+    stats = StatsWrapper(81970228, host=server.host)
+    pids = [81970228 + n for n in range(players)]
+
+    start = time()
+    expected = [sequential(stats, pid) for pid in pids]
+    one_by_one = time() - start
+    connections = server.connections
+
+    start = time()
+    batched = [stats.get_player(pid=pid) for pid in pids]
+    pipelined = time() - start
+    assert batched == expected
+    print '%d players, %d ms latency: sequential %.3fs (%d connections), ' \
+          'pipelined %.3fs (%d connections)' % (
+        players, latency, one_by_one, connections,
+        pipelined, server.connections - connections)
+    server.stop()
+
+    server = StandIn(close_after=3, fail=['getawardsinfo']).start()
+    stats = StatsWrapper(81970228, host=server.host)
+    player = stats.get_player()
+    expect = dict(expected[0], awards=None)
+    assert player == expect, 'broken batch differs'
+    print 'reconnect every 3 requests + failing awards: ok, %d connections' % server.connections
+    server.stop()
+
+    server = StandIn(drop_after=6).start()
+    stats = StatsWrapper(81970228, host=server.host)
+    assert stats.get_player() == expected[0], 'dropped batch differs'
+    print 'connection dropped mid-batch: ok, %d connections' % server.connections
+    server.stop()
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:3]))
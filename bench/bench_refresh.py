@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+""" Read latency of a skewed workload: TTL cache alone, with refresh-ahead,
+and with a warm start from the saved hot set.
+
+  python bench/bench_refresh.py [seconds per run]
+
+Reads follow a Zipf distribution over player pids and leaderboard pages
+against a stand-in with 20 ms latency; latencies are reported for the
+POPULAR most read keys, after a first TTL of warming up for the steady runs.
+"""
+
+import os, sys, random, tempfile
+from time import time, sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ea.rpc import StatsWrapper
+from ea.cache import QueryCache, Refresher
+from standin import StandIn
+
+PIDS = 2000
+TTL = 10.0
+POPULAR = 30 # keys reported on
+
+def workload(seed=2142, s=1.1):
+    """ Endless (weight rank, read) pairs, hot ones most often. """
+    rnd = random.Random(seed)
+    reads = [('info', 81000000 + n) for n in range(PIDS)] + \
+            [('board', 1 + 20 * n) for n in range(50)]
+    rnd.shuffle(reads)
+    weights = [1.0 / (n + 1) ** s for n in range(len(reads))]
+    total = sum(weights)
+    cumulative, acc = [], 0.0
+    for weight in weights:
+        acc += weight / total
+        cumulative.append(acc)
+    from bisect import bisect
+    while True:
+        n = min(bisect(cumulative, rnd.random()), len(reads) - 1)
+        yield n, reads[n]
+
+def read(stats, kind, value):
+    if kind == 'info':
+        return stats.player_info('ovr', value)
+    return stats.get_leader_board(value, 19, 'overallscore')
+
+def run(stats, seconds, skip=0, pause=0.002):
+    """ Latencies of popular reads, share of cache hits overall,
+    leaving out the first 'skip' seconds.
+    """
+    popular = []
+    cache = stats._rpc.cache
+    reads = workload()
+    begin = time() + skip
+    end = begin + seconds
+    counted = False
+    while time() < end:
+        if not counted and time() >= begin:
+            hits, misses = cache.hits, cache.misses
+            counted = True
+        rank, (kind, value) = reads.next()
+        start = time()
+        read(stats, kind, value)
+        if rank < POPULAR and counted:
+            popular.append(time() - start)
+        sleep(pause)
+    hits, misses = cache.hits - hits, cache.misses - misses
+    return popular, float(hits) / (hits + misses)
+
+def report(name, latencies, hit_rate):
+    latencies = sorted(latencies)
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    print '%-22s hits %5.1f%%  popular p50 %6.2f ms  p99 %6.2f ms  (%d reads)' % (
+        name, hit_rate * 100, pick(0.5), pick(0.99), len(latencies))
+    return pick(0.99)
+
+def main(seconds=10):
+    seconds = float(seconds)
+    server = StandIn(latency=0.02).start()
+    path = os.path.join(tempfile.mkdtemp(), 'hot.json')
+    try:
+        stats = StatsWrapper(host=server.host, cache=QueryCache(ttl=TTL))
+        cold = report('TTL cache', *run(stats, seconds, TTL))
+
+        stats = StatsWrapper(host=server.host, cache=QueryCache(ttl=TTL))
+        refresher = Refresher(stats._rpc, rate=30, burst=20, hot=150, ahead=2, path=path).start()
+        ahead = report('+ refresh-ahead', *run(stats, seconds, TTL))
+        refresher.stop()
+        print '%22s %d refreshes, %d failed' % ('', refresher.refreshed, refresher.failed)
+
+        stats = StatsWrapper(host=server.host, cache=QueryCache(ttl=TTL))
+        report('cold start, first 1s', *run(stats, 1))
+        stats = StatsWrapper(host=server.host, cache=QueryCache(ttl=TTL))
+        refresher = Refresher(stats._rpc, rate=1000, burst=150, hot=150, path=path)
+        start = time()
+        warmed = refresher.warm()
+        print '%22s warmed %d keys in %.2fs' % ('', warmed, time() - start)
+        report('warm start, first 1s', *run(stats, 1))
+        assert ahead < cold, 'refresh-ahead did not cut p99 of popular reads'
+    finally:
+        server.stop()
+        if os.path.exists(path):
+            os.unlink(path)
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+""" Per-token latency: in-process make_auth against the token daemon.
+
+Starts a daemon in a thread on a temporary socket, checks that it gives
+the same tokens, that a second daemon does not take its socket and that
+an RPC batch gets its tokens in one round trip, and measures single and
+pipelined requests, then the fallback with the daemon gone.
+
+  python bench/bench_tokend.py [count]
+"""
+
+import os, sys, socket, tempfile, threading
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ea.auth import make_auth
+from ea.rpc import StatsWrapper
+from ea.tokend import TokenServer, TokenClient
+from standin import StandIn
+
+def per_token(func, count):
+    start = time()
+    func()
+    return (time() - start) / count * 1e6
+
+def main(count=20000):
+    path = os.path.join(tempfile.mkdtemp(), 'tokend.sock')
+    server = TokenServer(path)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    client = TokenClient(path)
+
+    requests = [(81970228 + n, n % 2, 1160000000 + n) for n in xrange(count)]
+    assert client.make_auths(requests[:1000]) == [make_auth(*r) for r in requests[:1000]]
+
+    print 'in-process      %7.2f us/token' % per_token(
+        lambda: [make_auth(*r) for r in requests], count)
+    server.cache.clear()
+    print 'daemon, single  %7.2f us/token' % per_token(
+        lambda: [client(*r) for r in requests], count)
+    server.cache.clear()
+    print 'daemon, batched %7.2f us/token' % per_token(
+        lambda: client.make_auths(requests), count)
+    print 'daemon, cached  %7.2f us/token' % per_token(
+        lambda: client.make_auths(requests), count)
+
+    try:
+        TokenServer(path)
+    except socket.error:
+        pass
+    else:
+        raise AssertionError('a second daemon took over the socket')
+    exchange = client._exchange
+    exchanges = []
+    client._exchange = lambda requests: exchanges.append(requests) or exchange(requests)
+    standin = StandIn().start()
+    try:
+        player = StatsWrapper(81970228, host=standin.host, auth=client).get_player()
+    finally:
+        standin.stop()
+        del client._exchange
+    assert None not in player.values() and len(exchanges) == 1
+    print 'get_player batch: %d tokens in one round trip' % len(exchanges[0])
+
+    server.shutdown()
+    server.server_close()
+    client.close()
+    assert client(*requests[0]) == make_auth(*requests[0])
+    print 'fallback        %7.2f us/token' % per_token(
+        lambda: client.make_auths(requests), count)
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:2]))
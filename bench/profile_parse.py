@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+""" Time and memory per stage of the parse/format pipeline, with limits.
+
+Stages, run over recorded responses (every getplayerinfo mode, awards and
+unlocks; the stand-in's canned bodies unless a directory of recorded
+C{<func>-<mode>.txt} bodies is given):
+
+  init_modes      - StatsWrapper() construction, mode tables included
+  process_result  - Query.feed() of each response
+  format          - formatting the parsed rows of each response
+
+For each, per call: time, peak memory (traced bytes with tracemalloc, the
+growth of the process' peak RSS without it, in whole pages, '-' where that
+can not be reset), blocks allocated and still alive (tracemalloc only), gc
+objects allocated (see L{bench_auth.allocated}) and the bytes and objects
+reachable from the results, instance attributes included.
+Exits with 1 when a stage allocates or keeps more than its entry in LIMITS;
+time and peak are only reported, they depend on the machine.
+
+  python bench/profile_parse.py [recorded responses dir]
+"""
+
+import os, sys, gc
+from time import time
+from types import InstanceType
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ea.rpc import Query, StatsWrapper
+from standin import canned
+from bench_auth import allocated
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+MODES = ('ovr', 'ply', 'titan', 'wrk', 'com', 'wep', 'veh', 'map')
+
+# Per call, for the stand-in's bodies. Allocated gc objects, kept bytes and
+# objects are the same on every machine (a StatsWrapper building its own
+# mode tables keeps ~116 KiB in ~580 objects, formatted rows with their own
+# copies of the keys ~14 KiB).
+LIMITS = {
+    'init_modes':     {'allocs': 12, 'objects': 20, 'kept': 4 * 1024},
+    'process_result': {'allocs': 30, 'objects': 200, 'kept': 20 * 1024},
+    'format':         {'allocs': 50, 'objects': 160, 'kept': 12 * 1024},
+}
+
+def responses(path=None):
+    """ [(func, mode, body)] recorded in path, or the stand-in's. """
+    calls = [('getplayerinfo', mode) for mode in MODES]
+    calls += [('getawardsinfo', None), ('getunlocksinfo', None)]
+    recorded = []
+    for func, mode in calls:
+        if path:
+            name = os.path.join(path, '%s-%s.txt' % (func, mode or 'all'))
+            if not os.path.exists(name):
+                continue
+            body = open(name, 'rb').read()
+        else:
+            body = canned(func, mode and {'mode': mode} or {})
+        recorded.append((func, mode, body))
+    return recorded
+
+def deep_size(obj, seen=None):
+    """ (bytes, objects) of an object and everything in it, instance attributes included. """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0, 0
+    seen.add(id(obj))
+    size, count = sys.getsizeof(obj), 1
+    if isinstance(obj, dict):
+        items = [item for pair in obj.iteritems() for item in pair]
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        items = obj
+    elif isinstance(obj, InstanceType):
+        items = [obj.__dict__]
+    else:
+        items = ()
+    for item in items:
+        more = deep_size(item, seen)
+        size += more[0]
+        count += more[1]
+    return size, count
+
+def _rss(field):
+    """ A /proc/self/status memory field in bytes, None off Linux. """
+    try:
+        for line in open('/proc/self/status'):
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) * 1024
+    except IOError:
+        return None
+
+def _reset_peak():
+    """ Bring the peak RSS down to the current one, False if it can't be (Linux 4.0+ only). """
+    try:
+        open('/proc/self/clear_refs', 'w').write('5')
+    except IOError:
+        return False
+    return True
+
+def measure(stage, args):
+    """ Run stage over args once: (peak bytes, blocks, (kept bytes, kept objects)),
+    peak and blocks None without tracemalloc.
+    """
+    gc.collect()
+    if tracemalloc:
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        base = tracemalloc.get_traced_memory()[0]
+        kept = [stage(*arg) for arg in args]
+        peak = tracemalloc.get_traced_memory()[1] - base
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename'))
+    else:
+        rss = _reset_peak() and _rss('VmRSS')
+        kept = [stage(*arg) for arg in args]
+        peak = blocks = None
+        if rss:
+            peak = _rss('VmHWM') - rss
+    size, objects = deep_size(kept)
+    return peak, blocks, (size - sys.getsizeof(kept), objects - 1)
+
+def timeit(stage, args, repeat):
+    start = time()
+    for n in xrange(repeat):
+        for arg in args:
+            stage(*arg)
+    return (time() - start) / repeat / len(args)
+
+def stages(recorded):
+    """ {name: (function, [args])} """
+    stats = StatsWrapper()
+    query = Query('localhost', 'getplayerinfo')
+    formats = {
+        'getplayerinfo': stats._format_player_info,
+        'getawardsinfo': lambda mode, rows: stats._format_awards(rows),
+        'getunlocksinfo': lambda mode, rows: stats._format_unlocks(rows),
+    }
+    parsed = [(formats[func], mode, query.feed(body)) for func, mode, body in recorded]
+    return {
+        'init_modes': (StatsWrapper, [()] * 20),
+        'process_result': (query.feed, [(body,) for func, mode, body in recorded]),
+        'format': (lambda format, mode, rows: format(mode, rows), parsed),
+    }
+
+def main(path=None, repeat=200):
+    failed = []
+    print '%-15s %9s %10s %8s %8s %10s %8s' % (
+        'stage', 'ms/call', 'peak', 'blocks', 'allocs', 'kept', 'objects')
+    for name, (stage, args) in sorted(stages(responses(path)).items()):
+        calls = float(len(args))
+        peak, blocks, kept = measure(stage, args)
+        numbers = {'ms': timeit(stage, args, repeat) * 1000, 'peak': None, 'blocks': None,
+                   'allocs': allocated(stage, args), 'kept': kept[0] / calls,
+                   'objects': kept[1] / calls}
+        if peak is not None:
+            numbers['peak'] = peak / calls
+        if blocks is not None:
+            numbers['blocks'] = blocks / calls
+        print '%-15s %9.3f %10s %8s %8.1f %10d %8.1f' % (
+            name, numbers['ms'], peak is None and '-' or '%d' % numbers['peak'],
+            blocks is None and '-' or '%.1f' % numbers['blocks'], numbers['allocs'],
+            numbers['kept'], numbers['objects'])
+        for key, limit in sorted(LIMITS[name].items()):
+            if numbers[key] > limit:
+                failed.append('%s: %s %.1f over %s' % (name, key, numbers[key], limit))
+    if not tracemalloc:
+        print 'tracemalloc is not available: peak is the growth of peak RSS, blocks are not counted'
+    for line in failed:
+        print 'LIMIT', line
+    return failed and 1 or 0
+
+if __name__ == '__main__':
+    sys.exit(main(*sys.argv[1:2]))
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+""" Local stand-in for the stats server, for benchmarks and checks.
+
+Answers C{/<func>.aspx} GETs with made-up data in the server's format,
+built from L{ea.rpc.StatsWrapper}'s own format tables. It speaks HTTP/1.1
+keep-alive, so pipelined requests are answered in order.
+
+>>> server = StandIn()       # picks a free port
+>>> server.start()
+>>> rpc = RPC(pid, host=server.host)
+>>> server.stop()
+
+Knobs: 'latency' (round-trip time: added to a request unless it was
+already waiting, pipelined behind another one), 'close_after' (drop the
+connection after that many requests on it), 'drop_after' (likewise, but
+without answering the last one), 'fail' (set of functions answered with
+HTTP 500), 'error_rate' (share of any requests answered with HTTP 500),
+'slow_rate' and 'slow' (share of requests delayed by 'slow' seconds more),
+'encodings' (Content-Encodings offered, e.g. ('gzip', 'deflate'): the first
+one the client accepts is used), 'bandwidth' (bytes per second of a body).
+"""
+
+import os, sys, zlib, random, socket, threading
+from time import sleep
+from select import select
+from urlparse import urlparse, parse_qsl
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ea.rpc import StatsWrapper
+
+# criteria in the shape L{ea.criteria} reads, not the real game's
+SAMPLE_CONFIG = '''awards = {
+    '100': [klls >= 100, klls >= 1000 and kdr >= 1, klls >= 10000 and kdr >= 2],
+    '101': [wkls[0] >= 50, wkls[0] >= 500, wkls[0] >= 5000],
+    '200': sum(vkls) >= 1000,
+    '201': waccu[3] >= 40 or whts[3] >= 2000,
+    '300': win >= 100 and win / max(los, 1) >= 1.5,
+}
+ranks = {
+    1: gsco >= 40,
+    2: gsco >= 80,
+    3: gsco >= 120,
+    4: gsco >= 200,
+    5: gsco >= 330,
+    6: gsco >= 750,
+    7: gsco >= 1500,
+    8: gsco >= 3000,
+    9: gsco >= 5000 and klls >= 500,
+    10: gsco >= 10000 and klls >= 1000,
+    11: gsco >= 20000 and tt >= 360000,
+    12: gsco >= 50000 and tt >= 720000,
+}
+'''
+
+def table(*rows):
+    """ Server-formatted body from (keys, values) pairs. """
+    lines = ['O']
+    for keys, values in rows:
+        lines.append('H\t' + '\t'.join(keys))
+        lines.append('D\t' + '\t'.join(map(str, values)))
+    body = '\n'.join(lines) + '\n'
+    return body + '$\t%d\t$\n' % len(body)
+
+def value(key, fun, rnd):
+    """ A made-up value for a format entry. """
+    if fun is str:
+        return 'nick%d' % rnd.randint(0, 10**6)
+    if fun is float:
+        return '%.2f' % (rnd.random() * 100)
+    if key.lower() in ('date', 'acdt', 'lgdt', 'first', 'when'):
+        return 1160000000 + rnd.randint(0, 10**7)
+    return rnd.randint(0, 1000)
+
+def row(format, rnd, **fixed):
+    keys = sorted(format)
+    return keys, [fixed.get(key, value(key, format[key], rnd)) for key in keys]
+
+def canned(func, params, stats=StatsWrapper()):
+    """ Response body for a function, same for the same params. """
+    rnd = random.Random(repr(sorted(item for item in params.items() if item[0] != 'auth')) + func)
+    pid = params.get('pid', '81970228')
+    if func == 'getplayerinfo':
+        formats = stats.player_info_modes.get(params.get('mode'), {})
+        if isinstance(formats, list):
+            merged = {}
+            for format in formats:
+                merged.update(format)
+            formats = merged
+        return table(row(formats, rnd, pid=pid))
+    if func == 'getleaderboard':
+        format = stats.leader_board_modes.get(params.get('type'), {})
+        count = int(params.get('after', 10)) + 1
+        return table(*[row(format, rnd, pos=int(params.get('pos', 1)) + n)
+                       for n in range(count)])
+    if func == 'getplayerprogress':
+        format = stats.player_progress_modes.get(params.get('mode'), {})
+        keys = sorted(format)
+        lines = ['O', 'H\t' + '\t'.join(keys)]
+        for n in range(200):
+            fixed = {'date': 1160000000 + n * 3600}
+            lines.append('D\t' + '\t'.join(str(fixed.get(key, value(key, format[key], rnd)))
+                                           for key in keys))
+        return '\n'.join(lines) + '\n$\t0\t$\n'
+    if func == 'getawardsinfo':
+        return table(*[(('award', 'level', 'when', 'first'),
+                        ('%03d' % n, rnd.randint(1, 3), 1160000000 + n, 1160000000))
+                       for n in range(rnd.randint(1, 40))])
+    if func == 'getunlocksinfo':
+        return table(*[(('UnlockID',), ('%d%d%d' % (n % 5, n % 2 + 1, n % 4 + 1),))
+                       for n in range(rnd.randint(1, 20))])
+    if func == 'getbackendinfo':
+        return table(*[(('config',), (line,)) for line in SAMPLE_CONFIG.splitlines()])
+    if func == 'playersearch':
+        return table((('nick', 'pid'), (params.get('nick', 'nick'), pid)))
+    return 'E\t999\n$\t4\t$\n'
+
+def compress(body, encoding):
+    """ Body in a Content-Encoding: gzip or (zlib-wrapped) deflate. """
+    compressor = zlib.compressobj(6, zlib.DEFLATED,
+                                  encoding == 'gzip' and 16 + zlib.MAX_WBITS or zlib.MAX_WBITS)
+    return compressor.compress(body) + compressor.flush()
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.requests = 0
+
+    def handle_one_request(self):
+        # a request already read ahead or in the socket behind an earlier one
+        # did not wait for a round trip of its own
+        self.waiting = self.requests and (
+            self.rfile._rbuf.tell() > 0 or bool(select([self.connection], [], [], 0)[0]))
+        BaseHTTPRequestHandler.handle_one_request(self)
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        func = url.path.strip('/').split('.')[0]
+        self.requests += 1
+        server.count(func)
+        if server.drop_after and self.requests >= server.drop_after:
+            self.close_connection = 1
+            return
+        if server.latency and not self.waiting:
+            sleep(server.latency)
+        if server.slow_rate and random.random() < server.slow_rate:
+            sleep(server.slow)
+        if func in server.fail or (server.error_rate and random.random() < server.error_rate):
+            body, status = 'Internal error', 500
+        else:
+            body, status = canned(func, dict(parse_qsl(url.query))), 200
+        accepted = [encoding.split(';')[0].strip()
+                     for encoding in self.headers.get('Accept-Encoding', '').split(',')]
+        encoding = ([encoding for encoding in server.encodings if encoding in accepted] or [None])[0]
+        if encoding:
+            body = compress(body, encoding)
+        close = server.close_after and self.requests >= server.close_after
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        if close:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        if server.bandwidth:
+            for n in xrange(0, len(body), 8192):
+                piece = body[n:n + 8192]
+                self.wfile.write(piece)
+                sleep(len(piece) / float(server.bandwidth))
+        else:
+            self.wfile.write(body)
+        if close:
+            self.close_connection = 1
+
+    def log_message(self, *args):
+        pass
+
+class StandIn(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0, latency=0, close_after=0, drop_after=0, fail=(),
+                 error_rate=0, slow_rate=0, slow=0, encodings=(), bandwidth=0):
+        HTTPServer.__init__(self, ('127.0.0.1', port), Handler)
+        self.latency = latency
+        self.close_after = close_after
+        self.drop_after = drop_after
+        self.fail = set(fail)
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow = slow
+        self.encodings = encodings
+        self.bandwidth = bandwidth
+        self.requests = {}
+        self.connections = 0
+        self.open = {} # handler thread: connection
+        self.lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        # clients dropping connections mid-way is what some checks do;
+        # sys is gone when this runs in a thread at interpreter exit
+        kind = sys and sys.exc_info()[0]
+        if kind and not issubclass(kind, socket.error):
+            HTTPServer.handle_error(self, request, client_address)
+
+
+    @property
+    def host(self):
+        return '%s:%d' % self.server_address
+
+    def count(self, func):
+        with self.lock:
+            self.requests[func] = self.requests.get(func, 0) + 1
+
+    def process_request(self, request, client_address):
+        thread = threading.Thread(target=self.process_request_thread,
+                                  args=(request, client_address))
+        thread.daemon = True
+        with self.lock:
+            self.connections += 1
+            self.open[thread] = request
+        thread.start()
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        """ Stop serving and end kept-alive connections. """
+        self.shutdown()
+        self.server_close()
+        with self.lock:
+            open = self.open.items()
+        for thread, request in open:
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            thread.join(1.0)
+
+if __name__ == '__main__':
+    server = StandIn(*map(int, sys.argv[1:2]))
+    print 'serving on', server.host
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
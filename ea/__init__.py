@@ -1,3 +1,4 @@
+# -*- coding: utf-8 -*-
 """
 Package for querying EA/IGN's stat server. 
 
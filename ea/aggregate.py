@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+""" Batch derived stats over many players
+
+Loads formatted results of L{rpc.StatsWrapper.player_info} for lots of
+players into NumPy arrays and computes derived metrics, percentiles,
+group-bys and top-N lists on the whole lot at once.
+
+>>> players = Players.load(
+...     {'ovr': stats.player_info('ovr'), 'ply': stats.player_info('ply'),
+...      'wep': stats.player_info('wep'), 'veh': stats.player_info('veh'),
+...      'board': row} # optional leaderboard row with countrycode & rank
+...     for stats, row in fetched)
+>>> players.top('kdr', 10)
+>>> players.group_by('countrycode', 'spm')
+
+Requires U{NumPy <http://numpy.scipy.org>}.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from time import mktime
+from operator import itemgetter, add
+from itertools import chain
+from datetime import datetime
+
+from rpc import WEAPONS, VEHICLES
+
+# scalar modes, merged into one row per player
+SCALAR_MODES = ('ovr', 'ply', 'titan', 'wrk', 'com', 'board')
+# keys of per-weapon and per-vehicle columns
+WEAPON_KEYS = ('waccu', 'wdths', 'whts', 'wkdr', 'wkls', 'wshts', 'wtp', 'wtpk')
+VEHICLE_KEYS = ('vdstry', 'vdths', 'vkdr', 'vkls', 'vrkls', 'vtp')
+# kept as labels, not numbers
+LABELS = ('nick', 'countrycode')
+
+def _number(value):
+    """ Make a float out of a formatted value. """
+    if isinstance(value, datetime):
+        return mktime(value.timetuple())
+    return float(value)
+
+def _ratio(a, b):
+    """ a / b, zero where b is zero. """
+    out = numpy.zeros(len(a))
+    numpy.divide(a, b, out=out, where=b != 0)
+    return out
+
+class Players:
+    """ Column store of many players' stats.
+
+    Scalar stats are 1-d arrays in C{columns}, per-weapon and per-vehicle
+    stats are (players, weapons/vehicles) arrays in C{weapons} and
+    C{vehicles}, text fields are object arrays in C{labels}.
+    Missing scalars are NaN, missing weapon/vehicle cells are 0.
+    """
+    def __init__(self, pids, columns, weapons, vehicles, labels):
+        if numpy is None:
+            raise ImportError('NumPy is required for ea.aggregate')
+        self.pids = pids
+        self.columns = columns
+        self.weapons = weapons
+        self.vehicles = vehicles
+        self.labels = labels
+        self._derived = {}
+
+    @classmethod
+    def load(cls, players):
+        """ Build from an iterable of {mode: formatted result} dicts, one per player.
+
+        Modes are the L{rpc.StatsWrapper.player_info} ones, plus 'board'
+        for a leaderboard row (a dict or a one-row list).
+        """
+        if numpy is None:
+            raise ImportError('NumPy is required for ea.aggregate')
+        scalars = {}
+        labels = {}
+        wep_rows = []
+        veh_rows = []
+        pids = []
+        for n, results in enumerate(players):
+            row = {}
+            for mode in SCALAR_MODES:
+                data = results.get(mode)
+                if isinstance(data, list):
+                    data = data and data[0] or None
+                if data:
+                    row.update(data)
+            pids.append(int(row.get('pid', 0)))
+            for key, value in row.iteritems():
+                if key in LABELS:
+                    labels.setdefault(key, {})[n] = value
+                else:
+                    scalars.setdefault(key, {})[n] = _number(value)
+            wep_rows.append(results.get('wep') or ())
+            veh_rows.append(results.get('veh') or ())
+
+        count = len(pids)
+        columns = {}
+        for key, values in scalars.iteritems():
+            column = columns[key] = numpy.empty(count)
+            column.fill(numpy.nan)
+            column[values.keys()] = values.values()
+        label_columns = {}
+        for key, values in labels.iteritems():
+            column = label_columns[key] = numpy.empty(count, dtype=object)
+            column[values.keys()] = values.values()
+        return cls(numpy.array(pids, dtype=numpy.int64), columns,
+                   cls._matrix(wep_rows, WEAPON_KEYS, WEAPONS),
+                   cls._matrix(veh_rows, VEHICLE_KEYS, VEHICLES),
+                   label_columns)
+
+    @staticmethod
+    def _matrix(rows, keys, width):
+        """ Stack 'key-N' fields of every player's rows into (players, width) arrays. """
+        fields = ['%s-%d' % (key, n) for key in keys for n in range(width)]
+        getter = itemgetter(*fields)
+        zeros = (0,) * len(fields)
+        table = []
+        for results in rows:
+            line = zeros
+            for result in results:
+                try:
+                    values = getter(result)
+                except KeyError: # not padded, fill the gaps
+                    values = tuple(result.get(field, 0) for field in fields)
+                line = line is zeros and values or map(add, line, values)
+            table.append(line)
+        table = numpy.fromiter(chain.from_iterable(table), float, len(rows) * len(fields))
+        table = table.reshape(len(rows), len(keys), width)
+        return dict((key, table[:, n]) for n, key in enumerate(keys))
+
+    def __len__(self):
+        return len(self.pids)
+
+    def __getitem__(self, name):
+        """ A scalar or derived column by name. """
+        if name in self.columns:
+            return self.columns[name]
+        if name in self.labels:
+            return self.labels[name]
+        if name not in self._derived:
+            if not hasattr(self, '_metric_' + name):
+                raise KeyError(name)
+            self._derived[name] = getattr(self, '_metric_' + name)()
+        return self._derived[name]
+
+    def _column(self, name):
+        """ Scalar column with missing values as zeros. """
+        if name not in self.columns:
+            return numpy.zeros(len(self))
+        return numpy.nan_to_num(self.columns[name])
+
+    # derived metrics, reachable as players['name']
+
+    def _metric_kdr(self):
+        """ Kills per death. """
+        return _ratio(self._column('klls'), self._column('dths'))
+
+    def _metric_accuracy(self):
+        """ Hits per shot over all weapons. """
+        return _ratio(self.weapons['whts'].sum(1), self.weapons['wshts'].sum(1))
+
+    def _metric_spm(self):
+        """ Global score per minute of time played. """
+        return _ratio(self._column('gsco') * 60, self._column('tt'))
+
+    def _metric_win_ratio(self):
+        """ Wins per rounds finished. """
+        wins = self._column('win')
+        return _ratio(wins, wins + self._column('los'))
+
+    def _metric_weapon_kills(self):
+        return self.weapons['wkls'].sum(1)
+
+    def _metric_vehicle_kills(self):
+        return self.vehicles['vkls'].sum(1)
+
+    def _metric_favorite_weapon(self):
+        """ Weapon id with most time played. """
+        return self.weapons['wtp'].argmax(1)
+
+    def _metric_favorite_vehicle(self):
+        """ Vehicle id with most time played. """
+        return self.vehicles['vtp'].argmax(1)
+
+    def percentiles(self, name, q=(50, 90, 99)):
+        """ Percentiles of a column, ignoring missing values. """
+        values = self[name]
+        return numpy.percentile(values[~numpy.isnan(values)], q)
+
+    def top(self, name, n=10):
+        """ n best players by a column: list of (pid, value), best first. """
+        values = numpy.nan_to_num(self[name])
+        n = min(n, len(values))
+        if not n:
+            return []
+        best = numpy.argpartition(-values, n - 1)[:n]
+        best = best[numpy.argsort(-values[best], kind='mergesort')]
+        return zip(self.pids[best].tolist(), values[best].tolist())
+
+    def group_by(self, key, name, how='mean'):
+        """ Aggregate a column by groups of another column ('countrycode', 'rank'...).
+
+        how - one of 'mean', 'sum', 'count', 'min', 'max'.
+        Returns a {group: value} dict; missing values are left out.
+        """
+        values = self[name]
+        keys = self[key]
+        present = ~numpy.isnan(values)
+        if keys.dtype != object:
+            present &= ~numpy.isnan(keys)
+        else:
+            present &= keys != None
+        groups, inverse = numpy.unique(keys[present], return_inverse=True)
+        values = values[present]
+        counts = numpy.bincount(inverse, minlength=len(groups))
+        if how == 'count':
+            result = counts
+        elif how in ('sum', 'mean'):
+            result = numpy.bincount(inverse, weights=values, minlength=len(groups))
+            if how == 'mean':
+                result = result / counts
+        elif how in ('min', 'max'):
+            ufunc = getattr(numpy, how == 'min' and 'minimum' or 'maximum')
+            result = numpy.empty(len(groups))
+            result.fill(how == 'min' and numpy.inf or -numpy.inf)
+            ufunc.at(result, inverse, values)
+        else:
+            raise ValueError('Unknown aggregation: "%s"' % how)
+        return dict(zip(groups.tolist(), result.tolist()))
@@ -5,37 +5,45 @@ This is the python module for creating auth tokens of EA/IGN's stat server.
 """
 
 from time import time
-from struct import pack
+from struct import Struct
+from string import maketrans
+from threading import local
 
-from aes import DefEncryptBlock as aes
-from crc import compute         as crc
+from aes import DefEncryptInto as aes
+from crc import compute        as crc
+
+from binascii import b2a_base64
+
+# timestamp, 'magic number' 64 00 00 00, pid, server flag, pad
+_fields = Struct('<IB3xIBx')
+_checksum = Struct('<H')
+
+# EA's base64 alphabet: '+/' -> '[]', padding '=' -> '_'
+_alphabet = maketrans('+/=', '[]_')
 
-from base64 import b64encode
 def base64(s):
     """ Base64-encode string and translate it for using as EA's auth token. """
-    return b64encode(s,'[]').replace('=','_')
+    return b2a_base64(s).translate(_alphabet, '\n')
+
+_buffers = local()
+
+def _buffer():
+    """ Per-thread token buffer and a view on it, reused between calls. """
+    try:
+        return _buffers.token
+    except AttributeError:
+        buf = bytearray(16)
+        _buffers.token = buf, memoryview(buf)
+        return _buffers.token
 
 def make_auth(pid=0, as_server=False, timestamp=0):
     """ Assemble authentication token. """
-    data = ['\x00']*16
+    data, view = _buffer()
 
     if not timestamp:
         timestamp = int(time())
-    data[:4] = pack('L', timestamp)
-
-    # 'magic number' 64 00 00 00
-    data[4] = 'd'
-
-    data[8:12] = pack('L', pid)
-
-    if as_server:
-        data[12] = 1
-
-    dc = crc(data[:14])
-    try:
-        data[14:16] = pack('H', dc)
-    except:
-        print hex(dc)
+    _fields.pack_into(data, 0, timestamp, 0x64, pid, as_server and 1 or 0)
+    _checksum.pack_into(data, 14, crc(view[:14]))
 
     return base64(aes(data))
 
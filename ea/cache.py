@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+
+""" Query result cache with refresh-ahead of hot keys
+
+L{QueryCache} keeps successful query results for a TTL and counts every
+read made through L{rpc.RPC.make_query}, with exponential decay, so it
+knows which keys are hot. L{Refresher} re-fetches the hot ones shortly
+before they expire, within a request rate budget, and saves the hot set
+so the next run can warm up with it before serving reads:
+
+>>> cache = QueryCache(ttl=300, ttls={'getleaderboard': 600})
+>>> stats = StatsWrapper(cache=cache)
+>>> refresher = Refresher(stats._rpc, rate=2.0, path='hot.json')
+>>> refresher.warm()    # the previous run's hot set, if saved
+>>> refresher.start()   # background thread, refresher.stop() saves the hot set
+"""
+
+import json
+import heapq
+from time import time
+from threading import Thread, Event, Lock
+
+def _str(value):
+    """ Plain str for ASCII unicode from json, tuples for its lists. """
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return tuple(_str(item) for item in value)
+    return value
+
+class QueryCache:
+    """ Results of queries by (function, params), with an access log.
+
+    ttl - seconds a result is kept, ttls - per function overrides
+    size - results kept at most; the soonest to expire go first
+    halflife - seconds for an access to count half as much in hotness
+    """
+    def __init__(self, ttl=300, ttls=None, size=10000, halflife=3600):
+        self.ttl = ttl
+        self.ttls = ttls or {}
+        self.size = size
+        self.halflife = float(halflife)
+        self.entries = {} # key: (expires, query)
+        self.scores = {}  # key: (score, when)
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    @staticmethod
+    def key(func, kwargs):
+        return (func, tuple(sorted(kwargs.items())))
+
+    def get(self, key, now=None):
+        """ Query stored under key, None when missing or expired. Logs the access. """
+        now = now or time()
+        with self.lock:
+            self._touch(key, now)
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, key, query, now=None):
+        """ Keep an executed query if it succeeded. """
+        if query is None or query.status != 'ok':
+            return
+        now = now or time()
+        with self.lock:
+            if len(self.entries) >= self.size and key not in self.entries:
+                self._evict(now)
+            self.entries[key] = (now + self.lifetime(key[0]), query)
+
+    def lifetime(self, func):
+        """ TTL of a function's results. """
+        return self.ttls.get(func, self.ttl)
+
+    def expires(self, key):
+        """ When the result under key expires, 0 when there is none. """
+        entry = self.entries.get(key)
+        return entry and entry[0] or 0
+
+    def _touch(self, key, now):
+        score, when = self.scores.get(key, (0.0, now))
+        self.scores[key] = (score * 0.5 ** ((now - when) / self.halflife) + 1, now)
+        if len(self.scores) > 4 * self.size: # forget the coldest half
+            for key in self._ranked(now)[len(self.scores) // 2:]:
+                del self.scores[key]
+
+    def _evict(self, now):
+        expired = [key for key, entry in self.entries.items() if entry[0] <= now]
+        if not expired:
+            expired = [min(self.entries, key=lambda key: self.entries[key][0])]
+        for key in expired:
+            del self.entries[key]
+
+    def _ranked(self, now, count=None):
+        """ Logged keys, hottest first; the count hottest ones if given. """
+        def hotness(key):
+            score, when = self.scores[key]
+            return score * 0.5 ** ((now - when) / self.halflife)
+        if count is None:
+            return sorted(self.scores, key=hotness, reverse=True)
+        return heapq.nlargest(count, self.scores, key=hotness)
+
+    def hot(self, count, now=None):
+        """ The count hottest keys. """
+        with self.lock:
+            return self._ranked(now or time(), count)
+
+    def learn(self, keys, now=None):
+        """ Seed the access log with keys, hottest first (see L{Refresher.load}). """
+        now = now or time()
+        with self.lock:
+            for n, key in enumerate(keys):
+                score = self.scores.get(key, (0.0, now))[0]
+                self.scores[key] = (max(score, len(keys) - n), now)
+
+class Refresher:
+    """ Keep hot keys of a L{QueryCache} fresh.
+
+    rpc - a L{rpc.RPC} with a cache; the refresher queries through a copy of it
+    rate, burst - request budget: rate per second, burst at most at once
+    hot - how many of the hottest keys are kept fresh
+    ahead - refresh a key this many seconds before it expires
+    path - file for the hot set, read by L{warm} and written by L{stop}
+    backoff - seconds before retrying a key whose refresh failed, doubled
+    with every failure in a row, up to the key's TTL
+    """
+    def __init__(self, rpc, rate=1.0, burst=10, hot=500, ahead=30, path=None, backoff=5):
+        if rpc.cache is None:
+            raise ValueError('RPC has no cache to refresh')
+        self.rpc = rpc.__class__(rpc.pid, rpc.host, rpc.auth, rpc.cache)
+        self.cache = rpc.cache
+        self.rate = float(rate)
+        self.burst = burst
+        self.hot = hot
+        self.ahead = ahead
+        self.path = path
+        self.backoff = backoff
+        self.failing = {} # key: (failures in a row, not retried before)
+        self.tokens = burst
+        self.filled = time()
+        self.refreshed = 0
+        self.failed = 0
+        self.stopped = Event()
+        self.thread = None
+
+    def _fill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.filled) * self.rate)
+        self.filled = now
+
+    def due(self, now=None):
+        """ Hot keys missing or expiring within 'ahead' seconds (half their TTL
+        at most), soonest first. Keys whose refreshes keep failing are left
+        out until they back off.
+        """
+        now = now or time()
+        cache = self.cache
+        hot = cache.hot(self.hot, now)
+        failing = self.failing
+        if failing:
+            for key in set(failing).difference(hot): # cold again, forget them
+                del failing[key]
+        keys = [(cache.expires(key), key) for key in hot
+                if key not in failing or failing[key][1] <= now]
+        return [key for expires, key in sorted(keys)
+                if expires - now <= min(self.ahead, cache.lifetime(key[0]) / 2.0)]
+
+    def refresh(self, key, now=None):
+        func, params = key
+        try:
+            self.rpc.refresh(func, **dict(params))
+            ok = self.rpc.query.status == 'ok'
+        except Exception:
+            ok = False
+        if ok:
+            self.failing.pop(key, None)
+            self.refreshed += 1
+            return
+        self.failed += 1
+        failures = self.failing.get(key, (0, 0))[0] + 1
+        delay = min(self.backoff * 2 ** (failures - 1), self.cache.lifetime(func))
+        self.failing[key] = (failures, (now or time()) + delay)
+
+    def step(self, now=None):
+        """ Refresh what is due as far as the budget allows, return how many. """
+        now = now or time()
+        self._fill(now)
+        count = 0
+        for key in self.due(now):
+            if self.tokens < 1:
+                break
+            self.tokens -= 1
+            self.refresh(key, now)
+            count += 1
+        return count
+
+    def warm(self, path=None):
+        """ Load the saved hot set and fetch it, paced by the budget. Returns the key count. """
+        keys = self.load(path)
+        for key in keys:
+            now = time()
+            self._fill(now)
+            if self.tokens < 1:
+                self.stopped.wait((1 - self.tokens) / self.rate)
+                if self.stopped.is_set():
+                    break
+                self._fill(time())
+            self.tokens -= 1
+            self.refresh(key)
+        return len(keys)
+
+    def load(self, path=None):
+        """ Seed the cache's access log from a saved hot set, return its keys. """
+        path = path or self.path
+        try:
+            saved = json.load(open(path))
+        except (IOError, ValueError, TypeError):
+            return []
+        keys = [(_str(func), tuple(sorted((_str(name), _str(value)) for name, value in params)))
+                for func, params in saved]
+        self.cache.learn(keys)
+        return keys
+
+    def save(self, path=None):
+        """ Write the hot set, hottest first. """
+        path = path or self.path
+        if path:
+            json.dump([[func, params] for func, params in self.cache.hot(self.hot)], open(path, 'w'))
+
+    def run(self, interval=None):
+        """ Step until stopped, every interval seconds (default 1 / rate, at most 1). """
+        interval = interval or min(1.0, 1 / self.rate)
+        while not self.stopped.is_set():
+            self.step()
+            self.stopped.wait(interval)
+
+    def start(self, interval=None):
+        self.stopped.clear()
+        self.thread = Thread(target=self.run, args=(interval,))
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """ Stop the thread and save the hot set. """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.save()
@@ -29,10 +29,25 @@ table = (
         0x2e93, 0x3eb2, 0x0ed1, 0x1ef0
         )
 
+from struct import Struct
+
+_formats = {}
+
+def _bytes(data):
+    """ Iterate over byte values of a string, bytearray or memoryview without copying it. """
+    if isinstance(data, bytearray):
+        return data
+    if isinstance(data, list): # legacy: list of chars
+        return (ord(part) for part in data)
+    size = len(data)
+    if size not in _formats:
+        _formats[size] = Struct('%dB' % size)
+    return _formats[size].unpack_from(data)
+
 def compute(data):
     """ Compute correct enough :grin: CRC16 CCITT for using in BF2142 auth token """
     crc = 0
-    for byte in (ord(part) for part in data):
+    for byte in _bytes(data):
         ushort = (crc << 8) & 0xff00
         crc = ((ushort) ^ table[((crc >> 8) ^ (0xff & byte))])
     return crc
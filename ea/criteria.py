@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+
+""" Award and rank criteria compiled from the backend config
+
+L{rpc.StatsWrapper.get_backend_info} returns the game's award and rank
+criteria as Python-like text. L{Criteria} parses it once (never executing
+it), keeps it by content digest and compiles every criterion into a
+function over the columns of an L{aggregate.Players}, so progress of
+thousands of players is evaluated in one pass without the server.
+
+Understood config shape::
+
+    awards = {
+        'award id': expr,                  # single level
+        'award id': [expr, expr, ...],     # one criterion per level
+    }
+    ranks = {
+        1: expr,
+        2: expr,
+    }
+
+where expr is a Python expression over stat names: scalar keys as
+columns ('klls', 'gsco', derived 'kdr', 'spm'...), weapon and vehicle
+keys subscripted by id ('wkls[3]') or summed ('sum(wkls)'), numbers,
+arithmetic, comparisons, and/or/not, min(), max().
+
+Progress of a comparison 'value >= goal' is value/goal capped at 1; of
+'and' the mean of its parts, of 'or' the best part; anything else counts
+0 or 1.
+
+>>> criteria = Criteria.fetch(stats)
+>>> criteria.awards(players)['100']['progress']
+>>> rank, next_rank, progress = criteria.ranks(players)
+"""
+
+import ast
+import operator
+from hashlib import sha1
+from time import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from aggregate import WEAPON_KEYS, VEHICLE_KEYS
+
+_compare = {
+    ast.Gt: operator.gt, ast.GtE: operator.ge, ast.Lt: operator.lt,
+    ast.LtE: operator.le, ast.Eq: operator.eq, ast.NotEq: operator.ne,
+}
+_arithmetic = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+}
+
+def _divide(a, b):
+    """ a / b, zero where b is zero. """
+    a, b = numpy.broadcast_arrays(numpy.asarray(a, dtype=float), numpy.asarray(b, dtype=float))
+    out = numpy.zeros(a.shape)
+    numpy.divide(a, b, out=out, where=b != 0)
+    return out
+
+def _matrix(players, name):
+    """ Per-weapon or per-vehicle array of a key. """
+    if name in WEAPON_KEYS:
+        return players.weapons[name]
+    if name in VEHICLE_KEYS:
+        return players.vehicles[name]
+    raise ValueError('Not a weapon or vehicle stat: "%s"' % name)
+
+def _column(players, name):
+    try:
+        return numpy.nan_to_num(numpy.asarray(players[name], dtype=float))
+    except KeyError:
+        return numpy.zeros(len(players))
+
+class CriteriaError(ValueError):
+    """ Config text the compiler does not understand. """
+
+class Compiler:
+    """ Turn expression ASTs into functions of an L{aggregate.Players}.
+
+    Values compile to f(players) -> float array, predicates to
+    f(players) -> (satisfied bool array, progress float array).
+    """
+    def value(self, node):
+        if isinstance(node, ast.Num):
+            number = float(node.n)
+            return lambda players: number
+        if isinstance(node, ast.Name):
+            name = node.id
+            return lambda players: _column(players, name)
+        if isinstance(node, ast.Subscript):
+            if not (isinstance(node.value, ast.Name) and isinstance(node.slice, ast.Index)
+                    and isinstance(node.slice.value, ast.Num)):
+                raise CriteriaError('Only stat[id] subscripts are supported')
+            name, index = node.value.id, int(node.slice.value.n)
+            return lambda players: _matrix(players, name)[:, index]
+        if isinstance(node, ast.BinOp):
+            left, right = self.value(node.left), self.value(node.right)
+            if isinstance(node.op, ast.Div):
+                return lambda players: _divide(left(players), right(players))
+            if type(node.op) not in _arithmetic:
+                raise CriteriaError('Unsupported operator: %s' % type(node.op).__name__)
+            op = _arithmetic[type(node.op)]
+            return lambda players: op(left(players), right(players))
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            operand = self.value(node.operand)
+            return lambda players: -operand(players)
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+            return self.call(node.func.id, node.args)
+        raise CriteriaError('Unsupported value: %s' % ast.dump(node))
+
+    def call(self, name, args):
+        if name == 'sum' and len(args) == 1 and isinstance(args[0], ast.Name):
+            key = args[0].id
+            return lambda players: _matrix(players, key).sum(1)
+        if name in ('min', 'max') and args:
+            parts = [self.value(arg) for arg in args]
+            reduce_ = name == 'min' and numpy.minimum or numpy.maximum
+            return lambda players: reduce(reduce_, [part(players) for part in parts])
+        raise CriteriaError('Unsupported call: %s()' % name)
+
+    def predicate(self, node):
+        if isinstance(node, ast.Compare):
+            parts = []
+            left = node.left
+            for op, right in zip(node.ops, node.comparators):
+                parts.append(self.comparison(op, self.value(left), self.value(right)))
+                left = right
+            return len(parts) == 1 and parts[0] or self.both(parts)
+        if isinstance(node, ast.BoolOp):
+            parts = [self.predicate(value) for value in node.values]
+            if isinstance(node.op, ast.And):
+                return self.both(parts)
+            return self.either(parts)
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            operand = self.predicate(node.operand)
+            def negated(players):
+                satisfied = ~operand(players)[0]
+                return satisfied, satisfied.astype(float)
+            return negated
+        if isinstance(node, ast.Name) and node.id in ('True', 'False'):
+            truth = node.id == 'True'
+            def constant(players):
+                satisfied = numpy.empty(len(players), dtype=bool)
+                satisfied.fill(truth)
+                return satisfied, satisfied.astype(float)
+            return constant
+        raise CriteriaError('Unsupported criterion: %s' % ast.dump(node))
+
+    def comparison(self, op, left, right):
+        if type(op) not in _compare:
+            raise CriteriaError('Unsupported comparison: %s' % type(op).__name__)
+        compare = _compare[type(op)]
+        def predicate(players):
+            a = numpy.broadcast_to(left(players), (len(players),))
+            b = numpy.broadcast_to(right(players), (len(players),))
+            satisfied = compare(a, b)
+            if isinstance(op, (ast.Gt, ast.GtE)):
+                progress = numpy.where(b > 0, _divide(a, b), satisfied)
+            elif isinstance(op, (ast.Lt, ast.LtE)):
+                progress = numpy.where(a > 0, _divide(b, a), 1.0)
+            else:
+                progress = satisfied.astype(float)
+            progress = numpy.where(satisfied, 1.0, numpy.clip(progress, 0.0, 1.0))
+            return satisfied, progress
+        return predicate
+
+    def both(self, parts):
+        def predicate(players):
+            results = [part(players) for part in parts]
+            satisfied = numpy.logical_and.reduce([result[0] for result in results])
+            progress = numpy.mean([result[1] for result in results], axis=0)
+            return satisfied, progress
+        return predicate
+
+    def either(self, parts):
+        def predicate(players):
+            results = [part(players) for part in parts]
+            satisfied = numpy.logical_or.reduce([result[0] for result in results])
+            progress = numpy.max([result[1] for result in results], axis=0)
+            return satisfied, progress
+        return predicate
+
+def _literal(node):
+    """ Key of a config dict. """
+    if isinstance(node, ast.Str):
+        return node.s
+    if isinstance(node, ast.Num):
+        return node.n
+    raise CriteriaError('Unsupported key: %s' % ast.dump(node))
+
+class Criteria:
+    """ Compiled award and rank criteria of one config text. """
+    cache = {} # digest: Criteria
+    texts = {} # host: (when fetched, config text), see L{fetch}
+
+    def __init__(self, text):
+        if numpy is None:
+            raise ImportError('NumPy is required for ea.criteria')
+        self.digest = sha1(text).hexdigest()
+        self.award_levels = {} # award: [predicate per level]
+        self.rank_criteria = [] # [(rank, predicate)] by rank
+        compiler = Compiler()
+        try:
+            tree = ast.parse(text)
+        except SyntaxError, e:
+            raise CriteriaError('Can not parse config: %s' % e)
+        found = False
+        for statement in tree.body:
+            if not (isinstance(statement, ast.Assign) and len(statement.targets) == 1
+                    and isinstance(statement.targets[0], ast.Name)
+                    and isinstance(statement.value, ast.Dict)):
+                continue
+            name = statement.targets[0].id
+            entries = zip(statement.value.keys, statement.value.values)
+            if name in ('awards', 'ranks'):
+                found = True
+            if name == 'awards':
+                for key, value in entries:
+                    levels = isinstance(value, (ast.List, ast.Tuple)) and value.elts or [value]
+                    self.award_levels[_literal(key)] = [compiler.predicate(level) for level in levels]
+            elif name == 'ranks':
+                self.rank_criteria = sorted((_literal(key), compiler.predicate(value))
+                                            for key, value in entries)
+        if not found:
+            raise CriteriaError('No awards or ranks dict in config')
+
+    @classmethod
+    def compile(cls, text):
+        """ Criteria of a config text, compiled once per distinct text. """
+        digest = sha1(text).hexdigest()
+        if digest not in cls.cache:
+            cls.cache[digest] = cls(text)
+        return cls.cache[digest]
+
+    @classmethod
+    def fetch(cls, stats, ttl=3600):
+        """ Criteria from the server's backend info (see L{compile}).
+        The config text is asked for once per host every ttl seconds.
+        """
+        host = stats._rpc.host
+        now = time()
+        fetched, text = cls.texts.get(host, (None, None))
+        if fetched is None or now - fetched >= ttl:
+            text = '\n'.join(row['config'] for row in stats.get_backend_info())
+            criteria = cls.compile(text)
+            cls.texts[host] = (now, text)
+            return criteria
+        return cls.compile(text)
+
+    def awards(self, players):
+        """ Per award: {'level': levels reached, 'progress': toward the next one (1 when all done)}.
+
+        Levels count in order: a level counts only if all below it do.
+        """
+        result = {}
+        for award, levels in self.award_levels.items():
+            reached = numpy.zeros(len(players), dtype=int)
+            progress = numpy.ones(len(players))
+            going = numpy.ones(len(players), dtype=bool)
+            for predicate in levels:
+                satisfied, part = predicate(players)
+                stuck = going & ~satisfied
+                progress[stuck] = part[stuck]
+                going &= satisfied
+                reached += going
+            result[award] = {'level': reached, 'progress': progress}
+        return result
+
+    def ranks(self, players):
+        """ (rank reached, next rank, progress toward it) arrays.
+
+        Ranks count in order like award levels; players at the top rank
+        have it as next rank too, with progress 1. Rank is 0 below the first.
+        """
+        count = len(players)
+        rank = numpy.zeros(count, dtype=int)
+        following = numpy.zeros(count, dtype=int)
+        progress = numpy.ones(count)
+        going = numpy.ones(count, dtype=bool)
+        for number, predicate in self.rank_criteria:
+            satisfied, part = predicate(players)
+            stuck = going & ~satisfied
+            following[stuck] = number
+            progress[stuck] = part[stuck]
+            going &= satisfied
+            rank[going] = number
+        following[going] = rank[going]
+        return rank, following, progress
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+""" Latency-aware selection between stat hosts
+
+L{HostPool} keeps an EWMA of latency and error rate per host, sends each
+function to the healthiest host serving it, hedges slow requests with a
+delayed duplicate on the next best host and ejects failing hosts for a
+while (circuit breaker), letting a single probe through afterwards.
+
+>>> rpc = RPC(pid, host=HostPool([STELLA, BFWEB]))
+"""
+
+from time import time
+from random import random
+from threading import Thread, Timer, Lock
+from Queue import Queue, Empty
+
+class HostError(Exception):
+    """ A host did not answer properly (connection failure, HTTP 5xx...) """
+
+class Host:
+    """ Health of one host. """
+    def __init__(self, name, funcs=None):
+        self.name = name
+        self.funcs = funcs and set(funcs) or None # None serves everything
+        self.latency = None # EWMA, seconds
+        self.errors = 0.0   # EWMA of failures, 0..1
+        self.failures = 0   # in a row
+        self.open_until = 0 # breaker open (host ejected) until then
+        self.probing = False
+
+    def __repr__(self):
+        return '<Host %s latency=%s errors=%.2f failures=%d ejected=%s>' % (
+            self.name, self.latency, self.errors, self.failures, bool(self.open_until))
+
+    def serves(self, func):
+        return self.funcs is None or func in self.funcs
+
+    def score(self):
+        """ Expected cost of a request: latency, inflated by the error rate.
+        Hosts not measured yet come first.
+        """
+        if self.latency is None:
+            return 0
+        return self.latency * (1 + 10 * self.errors)
+
+class HostPool:
+    """ Route queries between several hosts.
+
+    hosts - host names, or a {name: functions served} dict
+    alpha - EWMA weight of the newest sample
+    hedge - hedge after this many times the host's usual latency (None: never;
+            a host without latency samples yet is not hedged)
+    hedge_min - but not earlier than that, seconds
+    failures - failures in a row to eject a host
+    cooldown - seconds an ejected host is left alone before a probe
+    timeout - connection timeout for queries, seconds
+    explore - share of requests sent to the runner-up instead of the best
+    """
+    def __init__(self, hosts, alpha=0.2, hedge=3.0, hedge_min=0.05,
+                 failures=3, cooldown=30.0, timeout=10.0, explore=0.02):
+        if isinstance(hosts, dict):
+            self.hosts = [Host(name, funcs) for name, funcs in hosts.items()]
+        else:
+            self.hosts = [Host(name) for name in hosts]
+        self.alpha = alpha
+        self.hedge = hedge
+        self.hedge_min = hedge_min
+        self.failures = failures
+        self.cooldown = cooldown
+        self.timeout = timeout
+        self.explore = explore
+        self.lock = Lock()
+
+    def __getitem__(self, name):
+        for host in self.hosts:
+            if host.name == name:
+                return host
+        raise KeyError(name)
+
+    def ranked(self, func):
+        """ Hosts serving func, best first; ejected ones only when due for a probe. """
+        now = time()
+        with self.lock:
+            hosts = [host for host in self.hosts if host.serves(func)]
+            if not hosts:
+                raise ValueError('No host serves "%s"' % func)
+            ready = [host for host in hosts if host.open_until <= now and not host.probing]
+            if not ready: # everything is ejected: try the one back soonest
+                ready = [min(hosts, key=lambda host: host.open_until)]
+            ready.sort(key=Host.score)
+            if len(ready) > 1 and random() < self.explore: # keep runner-up's stats fresh
+                ready[0], ready[1] = ready[1], ready[0]
+            # hosts back from ejection get the next request as a probe
+            ready.sort(key=lambda host: not host.open_until)
+            return ready
+
+    def choose(self, func):
+        """ Name of the best host for a function. """
+        return self.ranked(func)[0].name
+
+    def record(self, host, latency=None, ok=True):
+        """ Account a finished request. """
+        alpha = self.alpha
+        with self.lock:
+            host.probing = False
+            host.errors = (1 - alpha) * host.errors + alpha * (not ok)
+            if ok:
+                if host.open_until: # probe passed: the host is back
+                    host.errors = 0.0
+                host.failures = 0
+                host.open_until = 0
+                if latency is None:
+                    pass
+                elif host.latency is None:
+                    host.latency = latency
+                else:
+                    host.latency = (1 - alpha) * host.latency + alpha * latency
+            else:
+                host.failures += 1
+                if host.failures >= self.failures or host.open_until:
+                    host.open_until = time() + self.cooldown
+
+    def _run(self, host, run, results):
+        start = time()
+        done = (host, False, HostError('%s: no result' % host.name))
+        try:
+            try:
+                done = (host, True, run(host.name))
+            except Exception, e:
+                done = (host, False, e)
+            if done[1]:
+                self.record(host, time() - start)
+            else:
+                self.record(host, ok=False)
+        finally: # execute() waits for every started request
+            results.put(done)
+
+    def _start(self, host, run, results):
+        if host.open_until: # half-open: this request is the probe
+            host.probing = True
+        thread = Thread(target=self._run, args=(host, run, results))
+        thread.daemon = True
+        thread.start()
+
+    def execute(self, func, run):
+        """ Call run(host name) on the best host for func, hedging and failing over.
+
+        run should raise on a failed request. Returns the first successful
+        result; if every host failed, raises the last error as L{HostError}.
+        """
+        hosts = self.ranked(func)
+        results = Queue()
+        running = 0
+        error = None
+        timer = None
+        try:
+            while hosts or running:
+                if hosts and not running:
+                    host = hosts.pop(0)
+                    self._start(host, run, results)
+                    running += 1
+                if timer is None and hosts and self.hedge is not None and host.latency is not None:
+                    # Queue.get(timeout) polls on 2.x, a timer keeps the wait for results exact
+                    timer = Timer(max(self.hedge_min, self.hedge * host.latency), results.put, [None])
+                    timer.daemon = True
+                    timer.start()
+                done = results.get()
+                if done is None: # slow: hedge on the next host
+                    timer = None
+                    if hosts:
+                        host = hosts.pop(0)
+                        self._start(host, run, results)
+                        running += 1
+                    continue
+                running -= 1
+                if done[1]:
+                    return done[2]
+                error = done[2]
+                if timer is not None:
+                    timer.cancel()
+                    timer = None
+            raise HostError(error)
+        finally:
+            if timer is not None:
+                timer.cancel()
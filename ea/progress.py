@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+""" Player progress time-series store
+
+Keeps L{rpc.StatsWrapper.get_player_progress} results in append-only
+arrays, one series per (pid, mode), and downsamples them to any number of
+points (min/max/avg per bucket) so graphs of any zoom are drawn locally.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from time import mktime
+from datetime import datetime
+
+def _epoch(value):
+    """ Seconds since epoch from a formatted timestamp. """
+    if isinstance(value, datetime):
+        return mktime(value.timetuple())
+    return float(value)
+
+class Series:
+    """ Append-only columns of one progress graph, ordered by date. """
+    def __init__(self, keys):
+        self.keys = tuple(keys)
+        self.dates = array('d')
+        self.columns = dict((key, array('d')) for key in self.keys)
+
+    def __len__(self):
+        return len(self.dates)
+
+    def extend(self, rows):
+        """ Append formatted rows newer than the last stored one. Returns number added. """
+        last = None
+        if self.dates:
+            last = self.dates[-1]
+        added = 0
+        for date, row in sorted((_epoch(row['date']), row) for row in rows):
+            if last is not None and date <= last:
+                continue
+            self.dates.append(date)
+            for key in self.keys:
+                self.columns[key].append(float(row.get(key, 0)))
+            last = date
+            added += 1
+        return added
+
+    def downsample(self, points, start=None, end=None):
+        """ Reduce [start, end] to at most 'points' buckets of equal time span.
+
+        start, end - datetimes or epoch seconds, default to the whole series.
+        Returns a list of {'date': bucket start, key: (min, max, avg)} dicts,
+        empty buckets are left out.
+        """
+        dates = self.dates
+        if not dates or points < 1:
+            return []
+        if start is None:
+            start = dates[0]
+        if end is None:
+            end = dates[-1]
+        start, end = _epoch(start), _epoch(end)
+        lo = bisect_left(dates, start)
+        hi = bisect_right(dates, end)
+        if lo >= hi:
+            return []
+        span = float(end - start) / points or 1.0
+
+        result = []
+        bucket = None
+        for n in xrange(lo, hi):
+            slot = min(int((dates[n] - start) / span), points - 1)
+            if slot != bucket:
+                if bucket is not None:
+                    result.append(self._bucket(start + bucket * span, first, n))
+                bucket, first = slot, n
+        result.append(self._bucket(start + bucket * span, first, hi))
+        return result
+
+    def _bucket(self, date, lo, hi):
+        """ min/max/avg of every column over [lo, hi). """
+        bucket = {'date': datetime.fromtimestamp(date)}
+        for key in self.keys:
+            values = self.columns[key][lo:hi]
+            bucket[key] = (min(values), max(values), sum(values) / len(values))
+        return bucket
+
+class ProgressStore:
+    """ Progress series of many players, keyed by (pid, mode). """
+    def __init__(self):
+        self.series = {}
+
+    def __contains__(self, key):
+        return key in self.series
+
+    def get(self, pid, mode):
+        return self.series.get((pid, mode))
+
+    def extend(self, pid, mode, rows, keys):
+        """ Store formatted rows of a mode; keys are its value columns.
+        No rows store nothing, not even an empty series.
+        """
+        series = self.series.get((pid, mode))
+        if series is None:
+            if not rows:
+                return 0
+            series = self.series[(pid, mode)] = Series(keys)
+        return series.extend(rows)
+
+    def downsample(self, pid, mode, points, start=None, end=None):
+        """ See L{Series.downsample}; empty if nothing stored. """
+        series = self.series.get((pid, mode))
+        if series is None:
+            return []
+        return series.downsample(points, start, end)
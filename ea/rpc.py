@@ -12,13 +12,134 @@ Copyright © 2006 Alexander Bondarenko <wiz@aenor.ru>
 STELLA = 'stella.prod.gamespy.com'
 BFWEB = 'bf2142web.gamespy.com'
 
-from auth import make_auth
-
-from httplib import HTTPConnection
+# those should be grabbed directly from the game
+WEAPONS = 43
+VEHICLES = 15
+MAPS = 9
+MAP_MODES = 2
+
+from progress import ProgressStore
+from hosts import HostPool, HostError
+
+import socket
+import zlib
+from hashlib import md5
+from httplib import HTTPConnection, HTTPResponse, HTTPException
 from datetime import datetime
+from itertools import izip
+
+# what Query.execute accepts, and how many bytes it reads at once
+ACCEPT_ENCODING = 'gzip, deflate'
+CHUNK = 16384
+
+def _decompressor(encoding, head):
+    """ zlib decompressor for a Content-Encoding, None for identity.
+    'deflate' is meant to be zlib-wrapped but some servers send it raw,
+    the first bytes tell which one it is.
+    """
+    encoding = (encoding or 'identity').strip().lower()
+    if encoding in ('gzip', 'x-gzip'):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        wrapped = len(head) > 1 and ord(head[0]) & 0x0f == 8 and \
+            (ord(head[0]) << 8 | ord(head[1])) % 31 == 0
+        return zlib.decompressobj(wrapped and zlib.MAX_WBITS or -zlib.MAX_WBITS)
+    if encoding == 'identity':
+        return None
+    raise HTTPException('Unsupported Content-Encoding: %s' % encoding)
+
+class _Parser:
+    """ Parse server's response as it comes, in pieces of any size.
+    With rows=False it only takes the digest.
+    """
+    def __init__(self, rows=True):
+        self.rows = rows
+        self.started = False
+        self.status = None
+        self.result = []
+        self.keys = None
+        self.heading = True # the first line only tells ok or error
+        self.pending = ''   # start of a line not complete yet
+        self.done = False
+        self.digest = md5() # of the lines but the 'asof' pair, see L{Query.digest}
+        self.asof = False   # the next line is the 'asof' value
+
+    def feed(self, data):
+        if self.done or not data:
+            return
+        if not self.started:
+            self.started = True
+            if data[0] == 'E':
+                self.status = 'error'
+            elif data[0] == 'O':
+                self.status = 'ok'
+        if self.pending:
+            data = self.pending + data
+        lines = data.split('\n')
+        self.pending = lines.pop()
+        self._hash(lines)
+        if self.heading and lines:
+            self.heading = False
+            del lines[0]
+        if self.rows:
+            self._lines(lines)
+
+    def close(self):
+        """ Parse the last line, if it did not end with a new line. """
+        if self.pending and not self.done:
+            self._hash([self.pending])
+            if self.rows and not self.heading:
+                self._lines([self.pending])
+        self.pending = ''
+        return self.result
+
+    def _hash(self, lines):
+        update = self.digest.update
+        for line in lines:
+            if self.asof:
+                self.asof = False
+            elif line[:1] == 'H' and line.split()[1:] == ['asof']:
+                self.asof = True
+            else:
+                update(line)
+                update('\n')
+                if line[:1] == '$': # the end, as for _lines
+                    self.done = True
+                    break
+
+    def _lines(self, lines):
+        result = self.result
+        keys = self.keys
+        for line in lines:
+            if not line:
+                continue
+
+            if line[0] == 'H':
+                params = line.split()
+            else:
+                params = line.split('\t')
+
+            if len(params[0]) > 1:
+                params.insert(0, 'D')
+
+            if params[0] == 'H':
+                keys = params[1:]
+            elif params[0] == 'D':
+                values = params[1:]
+                if keys and (len(keys) == len(values)):
+                    result.append(dict(izip(keys, values)))
+            elif params[0] == '$':
+                result.append({'$': params[1]})
+                self.done = True
+                break
+        self.keys = keys
 
 class Query:
     """ Prepare arguments, request and process data from server."""
+    # keep the decompressed body in self.response; without it the body is
+    # only ever held a chunk at a time (self.digest tells bodies apart)
+    keep_response = False
+
     def __init__(self, host, func, **kwargs):
         """ Prepare a query.
         host - host where to request data
@@ -32,53 +153,179 @@ class Query:
         self.response = None
         self.result = None
         self.status = 'init'
+        self.code = None
+        self.wire = 0 # body bytes received, compressed or not
+        self.digest = None # md5 of the body without its 'asof' timestamp
+        self.known = None  # a digest: rows are only built for a body with another one
     def __str__(self):
         return str( {'status': self.status,
                      'request': self.request,
                      'response': self.response,
                      'result': self.result } )
     def execute(self):
-        """ Connect to server and fetch response """
-        self.connection.request("GET", self.request)
-        self.response = self.connection.getresponse().read()
-        self._process_result()
-        return self.result
+        """ Connect to server and fetch response.
+        Compressed responses are decompressed and parsed chunk by chunk.
+        """
+        try:
+            self.connection.request("GET", self.request,
+                                    headers={'Accept-Encoding': ACCEPT_ENCODING})
+            response = self.connection.getresponse()
+            self.code = response.status
+            return self._read(response)
+        finally: # don't keep a socket per query (they may be cached, see L{cache})
+            self.connection.close()
+
+    def _read(self, response):
+        ok = self.code == 200
+        known = ok and self.known or None
+        # with a known digest rows wait for the whole body, which is held until then
+        keep = self.keep_response or not ok or known is not None
+        parser = _Parser(known is None)
+        kept = []
+        decompressor = None
+        self.wire = 0
+        while True:
+            chunk = response.read(CHUNK)
+            if not chunk:
+                break
+            if not self.wire:
+                decompressor = _decompressor(response.getheader('content-encoding'), chunk)
+            self.wire += len(chunk)
+            if decompressor is not None:
+                chunk = decompressor.decompress(chunk)
+            if ok:
+                parser.feed(chunk)
+            if keep:
+                kept.append(chunk)
+        if decompressor is not None:
+            chunk = decompressor.flush()
+            if ok:
+                parser.feed(chunk)
+            if keep:
+                kept.append(chunk)
+        self.response = keep and ''.join(kept) or None
+        if not ok: # an error page: nothing to parse, see self.code
+            self.status = 'error'
+            self.result = []
+            self.digest = None
+            return self.result
+        if known is not None:
+            body = self.response
+            if not self.keep_response:
+                self.response = None
+            if parser.digest.digest() == known: # unchanged: no rows built
+                self.status = parser.status
+                self.digest = known
+                self.result = None
+                return self.result
+            parser = _Parser()
+            parser.feed(body)
+        return self._parsed(parser)
+
+    def feed(self, response):
+        """ Parse a response fetched elsewhere (see L{Pipeline}) """
+        self.response = self.keep_response and response or None
+        if not response:
+            return self.result
+        parser = _Parser()
+        parser.feed(response)
+        return self._parsed(parser)
 
     def _process_result(self):
         """ Parse server's response stored in self.response"""
         data = self.response
         if not data:
             return
-        
-        if data[0] == 'E':
-            self.status = 'error'
-            self.result = None
-        elif data[0] == 'O':
-            self.status = 'ok'
+        parser = _Parser()
+        parser.feed(data)
+        self._parsed(parser)
+
+    def _parsed(self, parser):
+        if not parser.started: # empty body
+            return self.result
+        if parser.status:
+            self.status = parser.status
+        self.result = parser.close()
+        self.digest = parser.digest.digest()
+        return self.result
 
-        result = []
-        for line in data.split('\n')[1:]:
-            if not line:
-                continue
-            
-            if line[0] == 'H':
-                params = line.split()
-            else:
-                params = line.split('\t')
+class _Reader:
+    """ Buffered socket file shared by pipelined responses.
+    HTTPResponse closes its file when done; this one stays open.
+    """
+    def __init__(self, fp):
+        self.fp = fp
+        self.read = fp.read
+        self.readline = fp.readline
+    def close(self):
+        pass
+
+class _Source:
+    """ Hands out the same reader to every HTTPResponse on a connection. """
+    def __init__(self, reader):
+        self.reader = reader
+    def makefile(self, *args):
+        return self.reader
+
+class Pipeline:
+    """ Run several queries to one host back-to-back on one connection.
+
+    All requests are written at once (HTTP/1.1 pipelining) and responses
+    are read in order. If the connection breaks or the server closes it,
+    the unanswered queries are sent again on a new one, up to 'retries'
+    times; then they are left with status 'error'. HTTP errors only fail
+    their own query.
+    """
+    def __init__(self, host, queries, retries=2, timeout=30):
+        self.host = host
+        self.queries = queries
+        self.retries = retries
+        self.timeout = timeout
+        self.connections = 0
 
-            if len(params[0]) > 1:
-                params.insert(0, 'D')
+    def _connect(self):
+        connection = HTTPConnection(self.host, timeout=self.timeout)
+        connection.connect()
+        self.connections += 1
+        return connection.sock
 
-            if params[0] == 'H':
-                keys = params[1:]
-            elif params[0] == 'D':
-                values = params[1:]
-                if keys and (len(keys) == len(values)):
-                    result.append(dict(zip(keys, values)))
-            elif params[0] == '$':
-                result.append({'$': params[1]})
-                break
-        self.result = result
+    def execute(self):
+        """ Fetch and parse all responses, return the list of results. """
+        pending = list(self.queries)
+        failures = 0
+        while pending:
+            sock = None
+            try:
+                sock = self._connect()
+                sock.sendall(''.join([
+                    'GET %s HTTP/1.1\r\nHost: %s\r\nAccept-Encoding: identity\r\n\r\n'
+                    % (query.request, self.host) for query in pending]))
+                source = _Source(_Reader(sock.makefile('rb')))
+                while pending:
+                    response = HTTPResponse(source, method='GET')
+                    response.begin()
+                    body = response.read()
+                    query = pending.pop(0)
+                    query.code = response.status
+                    if response.status == 200:
+                        query.feed(body)
+                    else:
+                        query.response = body
+                        query.status = 'error'
+                        query.result = None
+                    if response.will_close:
+                        break
+            except (socket.error, HTTPException):
+                failures += 1
+                if failures > self.retries:
+                    for query in pending:
+                        query.status = 'error'
+                        query.result = None
+                    break
+            finally:
+                if sock is not None:
+                    sock.close()
+        return [query.result for query in self.queries]
 
 class RPC:
     """ Make auth token and query a server.
@@ -87,15 +334,29 @@ class RPC:
 
     C{rpc.getfoo(spam='eggs') -> http://stat.host.name/getfoo.aspx?auth=I{....}&spam=eggs}
 
+    Pass a make_auth-like callable as 'auth' to get tokens elsewhere
+    (see L{tokend.TokenClient}); by default they are made in-process.
+
+    'host' may also be a L{hosts.HostPool} to spread queries over several
+    hosts by their health.
+
+    Pass a L{cache.QueryCache} as 'cache' to answer repeated queries from
+    it while fresh; its results are shared, don't change them.
+
     B{Handle with care and RTFM!}
     """
-    def __init__(self, pid=0, host=STELLA):
+    def __init__(self, pid=0, host=STELLA, auth=None, cache=None):
         self.host = host
         self.pid = pid
+        self.auth = auth
+        self.cache = cache
 
     def _make_auth(self, pid=None):
         """ Make fresh auth token for an avaiable pid. """
-        return make_auth(pid or self.pid or 0)
+        if self.auth is None:
+            from auth import make_auth # AES tables are built on import
+            self.auth = make_auth
+        return self.auth(pid or self.pid or 0)
 
     def make_query(self, func, **kwargs):
         """ Run a query against stat server.
@@ -103,10 +364,101 @@ class RPC:
         Pass the 'authpid' argument to override RPC-object's configured PID.
         (must do so for some functions - consult a U{tech wiki <http://bf2tech.org/BF2142_Statistics>}.)
         """
-        apid = kwargs.get('authpid', self.pid)
-        self.query = Query(self.host, func, **dict(kwargs, auth=self._make_auth(apid)))
+        if self.cache is None:
+            return self._fetch(func, kwargs)
+        key = self.cache.key(func, kwargs)
+        query = self.cache.get(key)
+        if query is not None:
+            self.query = query
+            return query.result
+        result = self._fetch(func, kwargs)
+        self.cache.put(key, self.query)
+        return result
+
+    def refresh(self, func, **kwargs):
+        """ Run a query past the cache and store its result there. """
+        result = self._fetch(func, kwargs)
+        if self.cache is not None:
+            self.cache.put(self.cache.key(func, kwargs), self.query)
+        return result
+
+    def changed(self, digest, func, **kwargs):
+        """ Run a query past the cache, building its rows only if the response
+        is not the one with this digest (see L{Query.digest}): None if it is.
+        """
+        return self._fetch(func, kwargs, digest)
+
+    def _fetch(self, func, kwargs, known=None):
+        if isinstance(self.host, HostPool):
+            # only the query that won is kept: a losing hedge may still be running
+            self.query = self.host.execute(func, lambda host: self._execute(host, func, kwargs, known))
+            return self.query.result
+        self.query = self._query(self.host, func, **kwargs)
+        self.query.known = known
         return self.query.execute()
 
+    def _execute(self, host, func, kwargs, known=None):
+        """ Run a query for a host pool, return it: failures raise.
+        Runs in the pool's threads, so it must not touch self.query.
+        """
+        query = self._query(host, func, **kwargs)
+        query.known = known
+        query.connection.timeout = self.host.timeout
+        try:
+            query.execute()
+        except (socket.error, HTTPException), e:
+            raise HostError('%s: %s' % (host, e))
+        if query.code >= 500:
+            raise HostError('%s: HTTP %d' % (host, query.code))
+        return query
+
+    def _query(self, host, func, **kwargs):
+        apid = kwargs.get('authpid', self.pid)
+        return Query(host, func, **dict(kwargs, auth=self._make_auth(apid)))
+
+    def _auths(self, calls):
+        """ Tokens for a batch of calls, all in one round trip when the auth
+        provider can make several at once (see L{tokend.TokenClient.make_auths}).
+        """
+        pids = [kwargs.get('authpid', self.pid) for func, kwargs in calls]
+        make_auths = getattr(self.auth, 'make_auths', None)
+        if make_auths is None:
+            return [self._make_auth(pid) for pid in pids]
+        return make_auths([(pid or self.pid or 0, False, 0) for pid in pids])
+
+    def make_batch(self, calls, retries=2):
+        """ Run several queries pipelined over one connection.
+
+        calls - list of (func, kwargs) pairs, as for L{make_query}.
+        Returns the list of results in the same order; failed ones are None.
+
+        With a L{hosts.HostPool} the batch goes to the best host for its
+        first function and fails over as a whole, like a single query, when
+        a connection keeps failing or the host answers with HTTP 5xx.
+        Its tokens are made once, before the first attempt.
+        """
+        if not calls:
+            return []
+        auths = self._auths(calls)
+        if isinstance(self.host, HostPool):
+            return self.host.execute(calls[0][0], lambda host: self._batch(host, calls, auths, retries))
+        return Pipeline(self.host, self._queries(self.host, calls, auths), retries).execute()
+
+    def _queries(self, host, calls, auths):
+        return [Query(host, func, **dict(kwargs, auth=auth))
+                for (func, kwargs), auth in izip(calls, auths)]
+
+    def _batch(self, host, calls, auths, retries):
+        """ Run a batch for a host pool: failures raise. """
+        queries = self._queries(host, calls, auths)
+        results = Pipeline(host, queries, retries, self.host.timeout).execute()
+        for query in queries:
+            if query.code is None:
+                raise HostError('%s: connection failed' % host)
+            if query.code >= 500:
+                raise HostError('%s: HTTP %d' % (host, query.code))
+        return results
+
     def __getattr__(self, name):
         """ Proxy all methods through _make_query
 
@@ -120,6 +472,84 @@ class RPC:
                 return self.make_query(name, **kwargs)
             return make_query
 
+def _timestamp(str):
+    """ Make a datetime object from string timestamp """
+    return datetime.fromtimestamp(int(str))
+
+def _numbered(count, **fields):
+    """ Format table of fields numbered from 'key-0' to 'key-<count - 1>' """
+    return dict(('%s-%d' % (key, n), fun) for key, fun in fields.items() for n in xrange(count))
+
+# Format dicts, different for each mode, containg '-'ses and not normalised.
+# Built once here and shared by all StatsWrappers: don't change them in place.
+PLAYER_INFO_MODES = {
+    'ovr': {'acdt': _timestamp, 'brs': int, 'crpt': int,
+            'fe': int, 'fgm': int, 'fk': int, 'fm': int, 'fv': int, 'fw': int,
+            'gsco': int, 'lgdt': _timestamp, 'los': int, 'nick': str,
+            'pdt': int, 'pdtc': int, 'pid': int, 'tid': int, 'tt': int,
+            'win': int, 'etp-3': int},
+    'ply':  {'adpr': float, 'akpr': float, 'dpm': float, 'dstrk': int, 'dths': int,
+             'kdr': float, 'kkls-0': int, 'kkls-1': int, 'kkls-2': int, 'kkls-3': int,
+             'klla': int, 'klls': int, 'klstrk': int, 'kpm': float, 'ktt-0': int,
+             'ktt-1': int, 'ktt-2': int, 'ktt-3': int, 'nick': str, 'ovaccu': float,
+             'pid': int, 'spm': float, 'suic': int, 'tid': int, 'toth': int, 'tots': int},
+    'titan':{'cts': int, 'nick': str, 'pid': int, 'tas': int, 'tcd': int, 'tcrd': int,
+             'tdrps': int, 'tds': int, 'tgd': int, 'tgr': int, 'tid': int, 'trp': int,
+             'ttp': int},
+    'wrk':  {'capa': int, 'cpt': int, 'cs': int, 'cts': int, 'dass': int, 'dcpt': int,
+             'hls': int, 'nick': str, 'pid': int, 'resp': int, 'rps': int, 'rvs': int,
+             'sasl': int, 'tac': int, 'talw': int, 'tasl': int, 'tasm': int, 'tdmg': int,
+             'tid': int, 'tkls': int, 'tvdmg': int, 'twsc': int},
+    'com':  {'cs': int, 'csgpm-0': int, 'csgpm-1': int, 'kluav': int, 'nick': str,
+             'pid': int, 'sasl': int, 'slbcn': int, 'slbspn': int, 'slpts': int,
+             'sluav': int, 'tac': int, 'tasl': int, 'tid': int, 'wkls-27': int},
+    'wep': _numbered(WEAPONS, # what awfull number of rows
+                     waccu=float, wdths=int, whts=int, wkdr=float,
+                     wkls=int, wshts=int, wtp=int, wtpk=int),
+    'veh': _numbered(VEHICLES, # what not-so-awfull-but-still-more-than-one number of rows
+                     vdstry=float, vdths=int, vkdr=float, vkls=int, vrkls=int, vtp=int),
+    'map': list(_numbered(MAPS, **dict(('%s-%d' % (key, mode), int) # boring...
+                                       for key in ('mbr', 'mlos', 'msc', 'mtt', 'mwin')))
+                for mode in range(MAP_MODES)),
+}
+
+_base = {'Vet': int, 'countrycode': str, 'nick': str, 'pid': int,
+         'pos': int, 'rank': int, 'playerrank': int} # 'dt': int
+LEADER_BOARD_MODES = {
+    'overallscore':   dict(_base, globalscore=int),
+    'combatscore':    dict(_base, Accuracy=float, Deaths=int, Kills=int, kdr=float),
+    'risingstar':     dict(_base, PercentChange=float),
+    'commanderscore': dict(_base, coscore=int),
+    'teamworkscore':  dict(_base, teamworkscore=int),
+    'efficiency':     dict(_base, Efficiency=float),
+
+    'weapon':         dict(_base, accuracy=float, deaths=int, kdr=float, kills=int),
+    'vehicle':        dict(_base, roadkills=int,  deaths=int, kills=int),
+
+    'supremecommander': {'Date': _timestamp, 'Times': int, 'Week': int,
+                         'nick': str, 'rank': int, 'Vet': lambda x:x in ('True', 1, '1', True)},
+}
+
+_date = {'date': _timestamp}
+PLAYER_PROGRESS_MODES = {
+    'point': dict(_date, points=int),
+    'score': dict(_date, gsco=int),
+    'ttp':   dict(_date, ttp=int),
+    'kills': dict(_date, klls=int),
+    'spm':   dict(_date, spm=float),
+    'role':  dict(_date, cmdt=int, sqlt=int, sqmt=int, lwt=int),
+    'flag':  dict(_date, cpt=int, dcpt=int),
+    'waccu': dict(_date, waccu=float),
+    'wl':    dict(_date, win=int, los=int),
+    'twsc':  dict(_date, twsc=int),
+    'sup':   dict(_date, sup=int),
+}
+
+# formatted '000' of every field of the tables formatted fuzzy, by table id
+_DEFAULTS = dict((id(format), dict((key, fun('000')) for key, fun in format.items()))
+                 for format in [PLAYER_INFO_MODES['wep'], PLAYER_INFO_MODES['veh']]
+                                + PLAYER_INFO_MODES['map'])
+
 class StatsWrapper:
     """ Abstraction class to enable pythonic access to stat server's data.
 
@@ -135,7 +565,11 @@ class StatsWrapper:
         Provide pid here or in functions.
         """
         self._rpc = RPC(pid, *args, **kwargs)
-        self.__init_modes()
+        self.progress = ProgressStore()
+
+    player_info_modes = PLAYER_INFO_MODES
+    leader_board_modes = LEADER_BOARD_MODES
+    player_progress_modes = PLAYER_PROGRESS_MODES
 
     def _have_data(self, dic, fields, fuzzy=False):
         """ Filter data with a list of keywords.
@@ -148,24 +582,67 @@ class StatsWrapper:
         """ Form dicts of data from matching rows of input.
         Set fuzzy to turn filtering off.
         """
-        return [
-            dict([ ( key, fun(fuzzy and line.get(key, '000') or line[key] ))
-                   for key, fun in format.items()])
-            for line in data
-            if self._have_data(line, format.keys()) or fuzzy
-            ]
+        return self._format_rows(data, format, fuzzy)
 
-    def _timestamp(self, str):
-        """ Make a datetime object from string timestamp """
-        return datetime.fromtimestamp(int(str))
+    def _format_rows(self, data, format, fuzzy=False):
+        """ L{_format} with the format as a dict, not copied to keywords.
+        Fuzzy rows start from a copy of every field's formatted '000',
+        made once for the player info tables.
+        """
+        if not fuzzy:
+            keys = format.keys()
+            items = format.items()
+            return [dict([(key, fun(line[key])) for key, fun in items])
+                    for line in data if self._have_data(line, keys)]
+        defaults = _DEFAULTS.get(id(format))
+        if defaults is None:
+            defaults = dict([(key, fun('000')) for key, fun in format.iteritems()])
+        results = []
+        for line in data:
+            result = defaults.copy()
+            for key, value in line.iteritems():
+                if value and key in format:
+                    result[key] = format[key](value)
+            results.append(result)
+        return results
+
+    _timestamp = staticmethod(_timestamp)
 
     def get_awards(self, pid=0):
         """ Gets a list of awards for a particular player.
         """
-        return self._format(
-            self._rpc.getawardsinfo(pid=pid or self._rpc.pid),
+        return self._format_awards(self._rpc.getawardsinfo(pid=pid or self._rpc.pid))
+
+    def _format_awards(self, data):
+        return self._format(data,
             first=self._timestamp, when=self._timestamp, award=str, level=int)
 
+    def get_player(self, modes=None, pid=0):
+        """ Gets several player_info modes, awards and unlocks at once.
+
+        All requests go pipelined over one connection, see L{RPC.make_batch}.
+        modes - player_info modes to fetch, all of them by default.
+
+        Returns a dict of formatted results by mode, plus 'awards' and
+        'unlocks'; a mode that failed is None.
+        """
+        pid = pid or self._rpc.pid
+        modes = list(modes or sorted(self.player_info_modes))
+        for mode in modes:
+            if mode not in self.player_info_modes:
+                raise ValueError('Unknown mode: "%s"' % mode)
+        results = self._rpc.make_batch(
+            [('getplayerinfo', {'pid': pid, 'mode': mode}) for mode in modes] +
+            [('getawardsinfo', {'pid': pid}), ('getunlocksinfo', {'authpid': pid})])
+        formats = [lambda data, mode=mode: self._format_player_info(mode, data)
+                   for mode in modes] + [self._format_awards, self._format_unlocks]
+        player = {}
+        for name, format, data in zip(modes + ['awards', 'unlocks'], formats, results):
+            player[name] = None
+            if data is not None:
+                player[name] = format(data)
+        return player
+
     def get_backend_info(self):
         """ Gets information used to update various files for the game.
         At the moment it returns some pythonic code for the config file
@@ -175,7 +652,7 @@ class StatsWrapper:
             self._rpc.getbackendinfo(authpid=0),
             config=str)
     
-    def player_info(self, mode):
+    def player_info(self, mode, pid=0):
         """ Gets player information.
 
         mode (required) - the stats mode that takes one of the following parameters:
@@ -188,21 +665,26 @@ class StatsWrapper:
           - wep - weapon stats
           - veh - vehicle stats
           - map - map stats
+        pid - player, the configured one by default
         """
-        modes = self.player_info_modes
-        if mode not in modes:
+        if mode not in self.player_info_modes:
             raise ValueError('Unknown mode: "%s"' % mode)
-        data = self._rpc.getplayerinfo(mode=mode)
+        return self._format_player_info(
+            mode, self._rpc.getplayerinfo(pid=pid or self._rpc.pid, mode=mode))
+
+    def _format_player_info(self, mode, data):
+        """ Format getplayerinfo rows of a mode. """
+        modes = self.player_info_modes
         if mode in ('wep', 'veh', 'map'): #those could not contain all the rows. thank you dice/ea!
             if type(modes[mode]) is list:
                 # multiple line formats
-                results = reduce( lambda x,y:x+y,
-                                  [ self._format( data, fuzzy=True, **format )
-                                    for format in modes[mode] ] )
+                results = []
+                for format in modes[mode]:
+                    results.extend(self._format_rows(data, format, fuzzy=True))
             else:
-                results = self._format( data, fuzzy=True, **modes[mode])
+                results = self._format_rows(data, modes[mode], fuzzy=True)
             return [result for result in results # drop empty rows after fuzzy formatting
-                    if sum(map(int, filter(lambda x: x != '000', result.values())))]
+                    if sum(int(value) for value in result.itervalues())]
         else:
             return self._format( data, **modes[mode])
 
@@ -243,14 +725,43 @@ class StatsWrapper:
             self._rpc.getleaderboard(pos=pos, after=after, type=mode, **kwargs),
             **modes[mode])
 
-    def get_player_progress(self, mode, scale='game'):
-        """ Gets statistical progress data used to draw the graphs in game. """
+    def get_player_progress(self, mode, scale='game', pid=0):
+        """ Gets statistical progress data used to draw the graphs in game.
+
+        mode (required) - one of: point, score, ttp, kills, spm, role, flag,
+                          waccu, wl, twsc, sup
+        scale - 'game' for a point per game, or a coarser server-side scale.
+
+        Per-game data of successful replies is also kept in C{self.progress}
+        for L{get_progress_graph}. Raises ValueError when the server sends
+        rows the mode's table can not format.
+        """
         modes = self.player_progress_modes
         if mode not in modes:
             raise ValueError('Unknown mode: "%s"' % mode)
-        return self._format(
-            self._rpc.getleaderboard(mode=mode, scale=scale)
-            **modes[mode])
+        pid = pid or self._rpc.pid
+        data = self._rpc.getplayerprogress(pid=pid, mode=mode, scale=scale)
+        result = self._format(data, **modes[mode])
+        rows = [row for row in data if '$' not in row]
+        if rows and not result: # the mode table does not match what the server sends
+            raise ValueError('No "%s" progress rows formatted: server sent %s, expected %s'
+                             % (mode, ', '.join(sorted(rows[0])), ', '.join(sorted(modes[mode]))))
+        if scale == 'game' and result and self._rpc.query.status == 'ok':
+            self.progress.extend(pid, mode, result,
+                                 [key for key in modes[mode] if key != 'date'])
+        return result
+
+    def get_progress_graph(self, mode, points=100, start=None, end=None, pid=0, refresh=False):
+        """ Progress graph downsampled to at most 'points' min/max/avg buckets.
+
+        Served from C{self.progress}; the server is asked only for a player
+        not fetched yet or when refresh is set.
+        See L{progress.Series.downsample} for the result.
+        """
+        pid = pid or self._rpc.pid
+        if refresh or (pid, mode) not in self.progress:
+            self.get_player_progress(mode, pid=pid)
+        return self.progress.downsample(pid, mode, points, start, end)
 
     def get_unlocks_info(self, pid=0):
         """ Gets a list of unlocked items.
@@ -260,9 +771,10 @@ class StatsWrapper:
           2. Col of unlock tree 1 or 2
           3. Order in unlock tree 1 to 4(highest)
         """
-        return self._format(
-            self._rpc.getunlocksinfo(authpid=pid or self._rpc.pid),
-            UnlockID=str)
+        return self._format_unlocks(self._rpc.getunlocksinfo(authpid=pid or self._rpc.pid))
+
+    def _format_unlocks(self, data):
+        return self._format(data, UnlockID=str)
 
     def player_search(self, nick):
         """ Finds a players based on their nick.
@@ -272,88 +784,3 @@ class StatsWrapper:
         return self._format(
             self._rpc.playersearch(nick=nick),
             nick=str, pid=int)
-
-    def __init_modes(self):
-        """ Precompile format dicts because they are different for each mode,
-        containg '-'ses and not normalised.
-        """
-        # those should be grabbed directly from the game
-        WEAPONS = 43
-        VEHICLES = 15
-        MAPS = 9
-        MAP_MODES = 2
-        
-        self.player_info_modes = {
-        'ovr': {'acdt': self._timestamp, 'brs': int, 'crpt': int,
-                'fe': int, 'fgm': int, 'fk': int, 'fm': int, 'fv': int, 'fw': int,
-                'gsco': int, 'lgdt': self._timestamp, 'los': int, 'nick': str,
-                'pdt': int, 'pdtc': int, 'pid': int, 'tid': int, 'tt': int,
-                'win': int, 'etp-3': int},
-        'ply':  {'adpr': float, 'akpr': float, 'dpm': float, 'dstrk': int, 'dths': int,
-                 'kdr': float, 'kkls-0': int, 'kkls-1': int, 'kkls-2': int, 'kkls-3': int,
-                 'klla': int, 'klls': int, 'klstrk': int, 'kpm': float, 'ktt-0': int,
-                 'ktt-1': int, 'ktt-2': int, 'ktt-3': int, 'nick': str, 'ovaccu': float,
-                 'pid': int, 'spm': float, 'suic': int, 'tid': int, 'toth': int, 'tots': int},
-        'titan':{'cts': int, 'nick': str, 'pid': int, 'tas': int, 'tcd': int, 'tcrd': int,
-                 'tdrps': int, 'tds': int, 'tgd': int, 'tgr': int, 'tid': int, 'trp': int,
-                 'ttp': int},
-        'wrk':  {'capa': int, 'cpt': int, 'cs': int, 'cts': int, 'dass': int, 'dcpt': int,
-                 'hls': int, 'nick': str, 'pid': int, 'resp': int, 'rps': int, 'rvs': int,
-                 'sasl': int, 'tac': int, 'talw': int, 'tasl': int, 'tasm': int, 'tdmg': int,
-                 'tid': int, 'tkls': int, 'tvdmg': int, 'twsc': int},
-        'com':  {'cs': int, 'csgpm-0': int, 'csgpm-1': int, 'kluav': int, 'nick': str,
-                 'pid': int, 'sasl': int, 'slbcn': int, 'slbspn': int, 'slpts': int,
-                 'sluav': int, 'tac': int, 'tasl': int, 'tid': int, 'wkls-27': int},
-        'wep': dict( # generate what awfull number of rows
-                     reduce(lambda x,y: x+y,
-                            [ [('%s-%d' % (key, n), val) for n in range(WEAPONS)]
-                              for key, val in
-                              { 'waccu': float, 'wdths': int, 'whts':int, 'wkdr':float,
-                                'wkls':int, 'wshts':int, 'wtp': int, 'wtpk': int,
-                              }.items()])),
-        'veh': dict( # generate what not-so-awfull-but-still-more-than-one number of rows
-                     reduce(lambda x,y: x+y,
-                            [ [('%s-%d' % (key, n), val) for n in range(VEHICLES)]
-                              for key, val in
-                              { 'vdstry': float, 'vdths': int, 'vkdr': float, 'vkls': int,
-                                'vrkls': int, 'vtp': int,
-                              }.items()])),
-        'map': [dict( # boring...
-                     reduce(lambda x,y: x+y,
-                            [ [('%s-%d-%d' % (key, mode, n), val) for n in range(MAPS)]
-                              for key, val in
-                              { 'mbr': int, 'mlos': int, 'msc': int, 'mtt': int, 'mwin': int,
-                              }.items()]))
-                for mode in range(MAP_MODES)],
-        }
-
-        base = { 'Vet': int, 'countrycode': str, 'nick': str, 'pid': int,
-                       'pos': int, 'rank': int, 'playerrank': int} # 'dt': int
-        self.leader_board_modes = {
-            'overallscore':   dict(base, globalscore=int),
-            'combatscore':    dict(base, Accuracy=float, Deaths=int, Kills=int, kdr=float),
-            'risingstar':     dict(base, PercentChange=float),
-            'commanderscore': dict(base, coscore=int),
-            'teamworkscore':  dict(base, teamworkscore=int),
-            'efficiency':     dict(base, Efficiency=float),
-
-            'weapon':         dict(base, accuracy=float, deaths=int, kdr=float, kills=int),
-            'vehicle':        dict(base, roadkills=int,  deaths=int, kills=int),
-
-            'supremecommander': {'Date': self._timestamp, 'Times': int, 'Week': int,
-                                 'nick': str, 'rank': int, 'Vet': lambda x:x in ('True', 1, '1', True)},
-        }
-
-        self.player_progress_modes = {
-            'point': {},
-            'score': {},
-            'ttp': {},
-            'kills': {},
-            'spm': {},
-            'role': {},
-            'flag': {},
-            'waccu': {},
-            'wl': {},
-            'twsc': {},
-            'sup': {},
-        }
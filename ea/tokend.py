@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+""" Shared auth token daemon
+
+One process makes (and caches) auth tokens for every worker on the host,
+workers ask it over a Unix socket with L{TokenClient}, which needs neither
+the AES tables nor much memory, and fall back to L{auth.make_auth} when
+the daemon is not there.
+
+Run the daemon with C{python tokend.py [socket path]}, then
+
+>>> rpc = RPC(pid, auth=TokenClient())
+
+Protocol: one request per line, C{"pid as_server timestamp\\n"}, answered
+in order by C{"token\\n"} or C{"E message\\n"}. Requests may be pipelined.
+"""
+
+import os
+import errno
+import socket
+from time import time
+from threading import Lock
+from SocketServer import ThreadingUnixStreamServer, BaseRequestHandler
+
+DEFAULT_SOCKET = '/tmp/bf2142-tokend.sock'
+
+class TokenError(ValueError):
+    """ The daemon could not make a token for a request. """
+
+class TokenHandler(BaseRequestHandler):
+    """ Answer every complete request line of a read in one write. """
+    def handle(self):
+        make = self.server.make_auth
+        pending = ''
+        while True:
+            data = self.request.recv(65536)
+            if not data:
+                return
+            lines = (pending + data).split('\n')
+            pending = lines.pop()
+            answers = []
+            now = int(time())
+            for line in lines:
+                try:
+                    pid, as_server, timestamp = map(int, line.split())
+                except ValueError:
+                    answers.append('E bad request\n')
+                    continue
+                try:
+                    answers.append(make(pid, as_server, timestamp or now) + '\n')
+                except Exception, e: # out of range values and such fail only their line
+                    answers.append('E %s\n' % str(e).replace('\n', ' '))
+            self.request.sendall(''.join(answers))
+
+def _listening(path):
+    """ Whether something accepts connections on a Unix socket path. """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+    return True
+
+class TokenServer(ThreadingUnixStreamServer):
+    """ Unix socket token server with a cache of recently made tokens. """
+    daemon_threads = True
+
+    def __init__(self, path=DEFAULT_SOCKET, cache_size=65536):
+        if os.path.exists(path):
+            if _listening(path):
+                raise socket.error(errno.EADDRINUSE, 'Token daemon already running on %s' % path)
+            os.unlink(path) # left over from a daemon that is gone
+        ThreadingUnixStreamServer.__init__(self, path, TokenHandler)
+        from auth import make_auth
+        self._make_auth = make_auth
+        self.cache = {}
+        self.cache_size = cache_size
+
+    def make_auth(self, pid, as_server, timestamp):
+        """ Cached L{auth.make_auth}: a token depends only on its arguments. """
+        key = (pid, as_server, timestamp)
+        token = self.cache.get(key)
+        if token is None:
+            token = self._make_auth(pid, as_server, timestamp)
+            if len(self.cache) >= self.cache_size:
+                self.cache.clear()
+            self.cache[key] = token
+        return token
+
+    def server_close(self):
+        ThreadingUnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+class TokenClient:
+    """ make_auth-compatible token provider backed by the daemon.
+
+    Falls back to in-process L{auth.make_auth} when the daemon can not be
+    reached, and tries it again after 'retry' seconds.
+    """
+    def __init__(self, path=DEFAULT_SOCKET, timeout=1.0, retry=30.0, batch=512):
+        self.path = path
+        self.batch = batch
+        self.timeout = timeout
+        self.retry = retry
+        self.sock = None
+        self.buffer = ''
+        self.lock = Lock()
+        self._down_until = 0
+        self._fallback = None
+
+    def __call__(self, pid=0, as_server=False, timestamp=0):
+        return self.make_auths([(pid, as_server, timestamp)])[0]
+
+    make_auth = __call__
+
+    def make_auths(self, requests):
+        """ Tokens for a list of (pid, as_server, timestamp).
+
+        Requests are pipelined, 'batch' of them per round trip so neither
+        side blocks writing while the other one is writing too.
+        A request the daemon refuses raises L{TokenError}; only a daemon
+        that can not be reached is skipped for 'retry' seconds.
+        """
+        requests = [(int(pid), as_server and 1 or 0, int(timestamp)) for pid, as_server, timestamp in requests]
+        if time() >= self._down_until:
+            with self.lock:
+                try:
+                    tokens = []
+                    for n in xrange(0, len(requests), self.batch):
+                        tokens.extend(self._exchange(requests[n:n + self.batch]))
+                except socket.error:
+                    self.close()
+                    self._down_until = time() + self.retry
+                else:
+                    for request, token in zip(requests, tokens):
+                        if token.startswith('E '):
+                            raise TokenError('%s: %s' % (request, token[2:]))
+                    return tokens
+        return [self.fallback(*request) for request in requests]
+
+    def fallback(self, pid, as_server, timestamp):
+        """ Make a token in this process. """
+        if self._fallback is None:
+            from auth import make_auth
+            self._fallback = make_auth
+        return self._fallback(pid, as_server, timestamp)
+
+    def _exchange(self, requests):
+        if self.sock is None:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(self.timeout)
+            self.sock.connect(self.path)
+            self.buffer = ''
+        self.sock.sendall(''.join(['%d %d %d\n' % request for request in requests]))
+        lines = self.buffer.split('\n')
+        while len(lines) <= len(requests):
+            data = self.sock.recv(65536)
+            if not data:
+                raise socket.error('Token daemon closed connection')
+            lines[-1:] = (lines[-1] + data).split('\n')
+        self.buffer = '\n'.join(lines[len(requests):])
+        return lines[:len(requests)]
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except socket.error:
+                pass
+        self.sock = None
+        self.buffer = ''
+
+if __name__ == '__main__':
+    import sys
+    server = TokenServer(*sys.argv[1:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+""" Award and unlock change watcher
+
+Polls a set of players and emits events for new awards, award level
+changes, new unlocks and rank changes:
+
+>>> watcher = Watcher(StatsWrapper(), [81970228, 81642192])
+>>> watcher.run(notify)   # or call watcher.poll() from your own loop
+
+Every check asks for the cheap 'ovr' mode first; awards and unlocks are
+fetched only when its last game date ('lgdt') moved, and an unchanged
+response is only hashed: no rows are built for it (see L{rpc.RPC.changed}),
+let alone a diff. A player is
+polled again after a share of the time since their last game, so active
+players are checked often and idle ones rarely.
+
+Events are dicts with 'pid' and 'event' ('award', 'level', 'unlock',
+'rank') plus 'award', 'level', 'unlock', 'old', 'new' where they apply.
+The first check of a player only records their state.
+"""
+
+import heapq
+from time import time, mktime, sleep
+
+class PlayerState:
+    """ What is remembered of a watched player. """
+    __slots__ = ('lgdt', 'rank', 'awards_digest', 'unlocks_digest', 'awards', 'unlocks')
+
+    def __init__(self):
+        self.lgdt = None
+        self.rank = None
+        self.awards_digest = None
+        self.unlocks_digest = None
+        self.awards = {}
+        self.unlocks = frozenset()
+
+class Watcher:
+    """ Adaptive poller of players' awards, unlocks and rank.
+
+    stats - a L{rpc.StatsWrapper}
+    min_interval, max_interval - bounds of a player's poll interval, seconds
+    activity - poll again after 1/activity of the time since the last game
+    """
+    def __init__(self, stats, pids=(), min_interval=300, max_interval=86400, activity=4):
+        self.stats = stats
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.activity = activity
+        self.players = {}
+        self.queue = [] # (due, pid) heap, removed pids are skipped lazily
+        self.errors = 0 # checks that raised, the last one in last_error as (pid, exception)
+        self.last_error = None
+        for pid in pids:
+            self.add(pid)
+
+    def add(self, pid, due=0):
+        if pid not in self.players:
+            self.players[pid] = PlayerState()
+            heapq.heappush(self.queue, (due, pid))
+
+    def remove(self, pid):
+        self.players.pop(pid, None)
+
+    def next_due(self):
+        """ When the next player is due, None if nobody is watched. """
+        while self.queue and self.queue[0][1] not in self.players:
+            heapq.heappop(self.queue)
+        if not self.queue:
+            return None
+        return self.queue[0][0]
+
+    def interval(self, state, now):
+        """ Seconds until a player's next check. """
+        if state.lgdt is None:
+            return self.min_interval
+        interval = (now - state.lgdt) / self.activity
+        return max(self.min_interval, min(self.max_interval, interval))
+
+    def poll(self, now=None):
+        """ Check every player due by now, return their events. """
+        now = now or time()
+        events = []
+        while self.next_due() is not None and self.queue[0][0] <= now:
+            due, pid = heapq.heappop(self.queue)
+            state = self.players[pid]
+            try:
+                events.extend(self.check(pid, state))
+            except Exception, e: # one player's failure must not stop the others
+                self.errors += 1
+                self.last_error = (pid, e)
+            heapq.heappush(self.queue, (now + self.interval(state, now), pid))
+        return events
+
+    def run(self, callback, idle=1.0):
+        """ Poll forever, calling callback(event) for each event. """
+        while True:
+            for event in self.poll():
+                callback(event)
+            due = self.next_due()
+            sleep(due is None and idle or max(0, min(due - time(), self.min_interval)))
+
+    def _last(self):
+        """ Response digest and rows of the last query made, None if it failed.
+        Rows are None for a response that had the digest asked for.
+        """
+        query = self.stats._rpc.query
+        if query.status != 'ok' or query.digest is None:
+            return None
+        return query.digest, query.result
+
+    def check(self, pid, state):
+        """ Refresh one player's state, return its events.
+        A failed awards or unlocks fetch leaves them and 'lgdt' as they were,
+        so the next check fetches both again.
+        """
+        stats = self.stats
+        first = state.lgdt is None
+        events = []
+
+        ovr = stats.player_info('ovr', pid)
+        last = self._last()
+        if not ovr or last is None:
+            return events
+        lgdt = mktime(ovr[0]['lgdt'].timetuple())
+        rank = [row['rnk'] for row in last[1] if 'rnk' in row]
+        rank = rank and int(rank[0]) or None
+        if rank != state.rank and not first and None not in (rank, state.rank):
+            events.append({'pid': pid, 'event': 'rank', 'old': state.rank, 'new': rank})
+        state.rank = rank
+        if lgdt == state.lgdt:
+            return events
+
+        stats._rpc.changed(state.awards_digest, 'getawardsinfo', pid=pid)
+        awards = self._last()
+        if awards is None:
+            return events
+        stats._rpc.changed(state.unlocks_digest, 'getunlocksinfo', authpid=pid)
+        unlocks = self._last()
+        if unlocks is None:
+            return events
+        state.lgdt = lgdt
+
+        digest, rows = awards
+        if digest != state.awards_digest:
+            state.awards_digest = digest
+            levels = dict((award['award'], award['level'])
+                          for award in stats._format_awards(rows))
+            if not first:
+                for award, level in sorted(levels.items()):
+                    old = state.awards.get(award)
+                    if old is None:
+                        events.append({'pid': pid, 'event': 'award', 'award': award, 'level': level})
+                    elif old != level:
+                        events.append({'pid': pid, 'event': 'level', 'award': award,
+                                       'old': old, 'new': level})
+            state.awards = levels
+
+        digest, rows = unlocks
+        if digest != state.unlocks_digest:
+            state.unlocks_digest = digest
+            unlocked = frozenset(unlock['UnlockID'] for unlock in stats._format_unlocks(rows))
+            if not first:
+                for unlock in sorted(unlocked - state.unlocks):
+                    events.append({'pid': pid, 'event': 'unlock', 'unlock': unlock})
+            state.unlocks = unlocked
+        return events